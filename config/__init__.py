@@ -5,6 +5,8 @@ from typing import Any
 import yaml
 from dotenv import dotenv_values
 
+from repostbot.photo_size_policy import PhotoSizePolicy
+from repostbot.retention import RetentionSettings
 from repostbot.strategies import get_all_callout_strategies, get_default_strategy
 
 logger = logging.getLogger(__name__)
@@ -24,7 +26,6 @@ class MutuallyExclusiveParametersException(Exception):
 
 def _ensure_proper_config_structure(data: dict[str, Any]):
     top_level = [
-        "repost_data_path",
         "bot_admin_id",
         "bot_token",
         "hash_size",
@@ -34,8 +35,32 @@ def _ensure_proper_config_structure(data: dict[str, Any]):
         "strings",
         "group_whitelist",
         "group_blacklist",
+        "database",
+        "hash_index",
+        "bloom_filter",
+        "near_duplicates",
+        "image_hashing",
+        "photo_size",
+        "file_hash_cache",
+        "albums",
+        "leaderboard",
+        "retention",
     ]
     toggles = ["url", "picture", "autocallout", "autodelete"]
+    database = ["path", "synchronous", "cache_size_kib", "mmap_size", "busy_timeout_ms", "cached_statements",
+                "worker_threads", "max_queued_operations", "write_behind", "write_behind_flush_interval_ms",
+                "write_behind_max_rows", "write_behind_max_retries"]
+    hash_index = ["max_memory_mb"]
+    bloom_filter = ["enabled", "error_rate", "initial_capacity"]
+    near_duplicates = ["default_threshold", "max_threshold", "max_groups", "search"]
+    image_hashing = ["executor", "max_workers", "max_queued", "max_in_memory_kb", "draft_decode",
+                     "default_algorithm"]
+    photo_size = ["min_dimension", "compatibility_threshold"]
+    file_hash_cache = ["max_entries"]
+    albums = ["window_ms"]
+    leaderboard = ["size", "windows"]
+    retention = ["max_age_days", "max_rows", "interval_minutes", "batch_size", "batch_pause_ms", "analyze_every",
+                 "vacuum_pages", "file_hash_max_age_days"]
     strings = [
         "private_chat",
         "private_chat_toggle",
@@ -47,6 +72,12 @@ def _ensure_proper_config_structure(data: dict[str, Any]):
         "settings_track_urls",
         "settings_auto_callout",
         "settings_auto_delete",
+        "settings_image_match_threshold",
+        "threshold_command_reply",
+        "invalid_threshold_reply",
+        "settings_hash_algorithm",
+        "algorithm_command_reply",
+        "invalid_algorithm_reply",
         "invalid_whitelist_reply",
         "removed_from_whitelist_reply",
         "added_and_removed_from_whitelist_reply",
@@ -59,6 +90,20 @@ def _ensure_proper_config_structure(data: dict[str, Any]):
         "group_repost_reset_cancel",
         "group_repost_data_reset",
         "stats_command_reply",
+        "bloom_filter_stats_reply",
+        "leaderboard_command_reply",
+        "leaderboard_line",
+        "leaderboard_empty_reply",
+        "invalid_stats_window_reply",
+        "my_stats_command_reply",
+        "my_stats_line",
+        "stats_window_all_time",
+        "stats_window_days",
+        "settings_retention_days",
+        "settings_retention_max_rows",
+        "retention_command_reply",
+        "invalid_retention_reply",
+        "retention_unlimited",
         "blacklisted_response",
         "not_in_whitelist_response",
     ]
@@ -71,6 +116,36 @@ def _ensure_proper_config_structure(data: dict[str, Any]):
     logger.info("TESTING DEFAULT TOGGLED SETTINGS")
     _check_config_fields(data.get("default_toggles"), toggles, "default toggles")
 
+    logger.info("TESTING DATABASE SETTINGS")
+    _check_config_fields(data.get("database"), database, "database settings")
+
+    logger.info("TESTING HASH INDEX SETTINGS")
+    _check_config_fields(data.get("hash_index"), hash_index, "hash index settings")
+
+    logger.info("TESTING BLOOM FILTER SETTINGS")
+    _check_config_fields(data.get("bloom_filter"), bloom_filter, "bloom filter settings")
+
+    logger.info("TESTING NEAR-DUPLICATE SETTINGS")
+    _check_config_fields(data.get("near_duplicates"), near_duplicates, "near-duplicate settings")
+
+    logger.info("TESTING IMAGE HASHING SETTINGS")
+    _check_config_fields(data.get("image_hashing"), image_hashing, "image hashing settings")
+
+    logger.info("TESTING PHOTO SIZE SETTINGS")
+    _check_config_fields(data.get("photo_size"), photo_size, "photo size settings")
+
+    logger.info("TESTING FILE HASH CACHE SETTINGS")
+    _check_config_fields(data.get("file_hash_cache"), file_hash_cache, "file hash cache settings")
+
+    logger.info("TESTING ALBUM SETTINGS")
+    _check_config_fields(data.get("albums"), albums, "album settings")
+
+    logger.info("TESTING LEADERBOARD SETTINGS")
+    _check_config_fields(data.get("leaderboard"), leaderboard, "leaderboard settings")
+
+    logger.info("TESTING RETENTION SETTINGS")
+    _check_config_fields(data.get("retention"), retention, "retention settings")
+
     logger.info("TESTING BOT STRINGS")
     _check_config_fields(data.get("strings"), strings, "strings")
 
@@ -111,10 +186,19 @@ def get_config_variables(config_path: str) -> tuple:
     default_strategy = None
     default_flood_protection_timeout = None
     default_hash_size = None
-    default_repost_data_path = None
     default_default_toggles = None
     default_group_whitelist = None
     default_group_blacklist = None
+    default_database = None
+    default_hash_index = None
+    default_bloom_filter = None
+    default_near_duplicates = None
+    default_image_hashing = None
+    default_photo_size = None
+    default_file_hash_cache = None
+    default_albums = None
+    default_leaderboard = None
+    default_retention = None
 
     if default_config_data is not None:
         logger.info("testing default config file for all required fields")
@@ -125,10 +209,19 @@ def get_config_variables(config_path: str) -> tuple:
         default_strategy = default_config_data.get("callout_style", get_default_strategy())
         default_flood_protection_timeout = default_config_data.get("flood_protection_timeout", None)
         default_hash_size = default_config_data.get("hash_size", None)
-        default_repost_data_path = default_config_data.get("repost_data_path", None)
         default_default_toggles = default_config_data.get("default_toggles", None)
         default_group_whitelist = default_config_data.get("group_whitelist", [])
         default_group_blacklist = default_config_data.get("group_blacklist", [])
+        default_database = default_config_data.get("database", {})
+        default_hash_index = default_config_data.get("hash_index", {})
+        default_bloom_filter = default_config_data.get("bloom_filter", {})
+        default_near_duplicates = default_config_data.get("near_duplicates", {})
+        default_image_hashing = default_config_data.get("image_hashing", {})
+        default_photo_size = default_config_data.get("photo_size", {})
+        default_file_hash_cache = default_config_data.get("file_hash_cache", {})
+        default_albums = default_config_data.get("albums", {})
+        default_leaderboard = default_config_data.get("leaderboard", {})
+        default_retention = default_config_data.get("retention", {})
 
     telegram_token = default_telegram_token
     bot_strings = default_bot_strings
@@ -136,10 +229,19 @@ def get_config_variables(config_path: str) -> tuple:
     strategy = default_strategy
     flood_protection_timeout = default_flood_protection_timeout
     hash_size = default_hash_size
-    repost_data_path = default_repost_data_path
     default_toggles = default_default_toggles
     group_whitelist = default_group_whitelist
     group_blacklist = default_group_blacklist
+    database = default_database
+    hash_index = default_hash_index
+    bloom_filter = default_bloom_filter
+    near_duplicates = default_near_duplicates
+    image_hashing = default_image_hashing
+    photo_size = default_photo_size
+    file_hash_cache = default_file_hash_cache
+    albums = default_albums
+    leaderboard = default_leaderboard
+    retention = default_retention
 
     if config_path is not None and config_data is not None:
         logger.info("testing user config file for all required fields")
@@ -150,20 +252,38 @@ def get_config_variables(config_path: str) -> tuple:
         strategy = config_data.get("callout_style", default_strategy)
         flood_protection_timeout = config_data.get("flood_protection_timeout", default_flood_protection_timeout)
         hash_size = config_data.get("hash_size", default_hash_size)
-        repost_data_path = config_data.get("repost_data_path", default_repost_data_path)
         default_toggles = config_data.get("default_toggles", default_default_toggles)
         group_whitelist = config_data.get("group_whitelist", default_group_whitelist)
         group_blacklist = config_data.get("group_blacklist", default_group_blacklist)
+        database = {**(default_database or {}), **config_data.get("database", {})}
+        hash_index = {**(default_hash_index or {}), **config_data.get("hash_index", {})}
+        bloom_filter = {**(default_bloom_filter or {}), **config_data.get("bloom_filter", {})}
+        near_duplicates = {**(default_near_duplicates or {}), **config_data.get("near_duplicates", {})}
+        image_hashing = {**(default_image_hashing or {}), **config_data.get("image_hashing", {})}
+        photo_size = {**(default_photo_size or {}), **config_data.get("photo_size", {})}
+        file_hash_cache = {**(default_file_hash_cache or {}), **config_data.get("file_hash_cache", {})}
+        albums = {**(default_albums or {}), **config_data.get("albums", {})}
+        leaderboard = {**(default_leaderboard or {}), **config_data.get("leaderboard", {})}
+        retention = {**(default_retention or {}), **config_data.get("retention", {})}
 
     bot_variables = (
         bot_strings,
         strategy,
         flood_protection_timeout,
         hash_size,
-        repost_data_path,
         default_toggles,
         group_whitelist,
         group_blacklist,
+        database,
+        hash_index,
+        bloom_filter,
+        near_duplicates,
+        image_hashing,
+        photo_size,
+        file_hash_cache,
+        albums,
+        leaderboard,
+        retention,
     )
     if any(var is None for var in bot_variables):
         raise MissingConfigParameterException("Missing required config parameters between default and user config files. Cannot proceed.")
@@ -181,13 +301,34 @@ def get_config_variables(config_path: str) -> tuple:
         strategy,
         flood_protection_timeout,
         hash_size,
-        repost_data_path,
         default_toggles,
         group_whitelist,
         group_blacklist,
+        database,
+        hash_index,
+        bloom_filter,
+        near_duplicates,
+        image_hashing,
+        _get_photo_size_policy(photo_size),
+        file_hash_cache,
+        albums,
+        leaderboard,
+        RetentionSettings.from_dict(retention),
     )
 
 
+def _get_photo_size_policy(photo_size: dict[str, Any]) -> PhotoSizePolicy:
+    policy = PhotoSizePolicy(photo_size.get("min_dimension", 0), photo_size.get("compatibility_threshold", 0))
+    if policy.uses_largest:
+        logger.info("Hashing the largest size of each picture")
+    else:
+        logger.info(f"Hashing the smallest size of each picture that's at least {policy.min_dimension}px")
+        if policy.compatibility_threshold > 0:
+            logger.info(f"Matching pictures within at least {policy.compatibility_threshold} bits in every group, "
+                        f"overriding lower group thresholds")
+    return policy
+
+
 def get_environment_variables():
     logger.info("Getting Telegram token and bot admin ID from environment variables")
     env_variables = {
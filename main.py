@@ -4,7 +4,17 @@ import logging
 
 from config import get_config_variables, get_environment_variables
 from repostbot import RepostBot
+from repostbot.bloom_filter import GroupBloomFilters
+from repostbot.db.connection import DatabaseSettings
+from repostbot.db.migrations import check_schema_version
+from repostbot.db.storage import RepostStorage
+from repostbot.file_hash_cache import FileHashCache
+from repostbot.hash_algorithms import DEFAULT_HASH_ALGORITHM
+from repostbot.hash_index import GroupHashIndex
+from repostbot.image_hashing import ImageHasher
+from repostbot.near_duplicates import NearDuplicateIndex, get_near_duplicate_search
 from repostbot.repostitory import Repostitory
+from repostbot.stats_window import get_stats_window, ALL_TIME
 from repostbot.strategies import get_callout_strategy
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -32,16 +42,47 @@ def main():
         strategy,
         flood_protection_timeout,
         hash_size,
-        repost_data_path,
         default_toggles,
         group_whitelist,
         group_blacklist,
+        database,
+        hash_index,
+        bloom_filter,
+        near_duplicates,
+        image_hashing,
+        photo_size_policy,
+        file_hash_cache,
+        albums,
+        leaderboard,
+        retention_settings,
     ) = get_config_variables(config_path)
 
     if use_env:
         telegram_token, bot_admin_id = get_environment_variables()
 
-    repostitory = Repostitory(hash_size, repost_data_path, default_toggles)
+    storage = RepostStorage(DatabaseSettings.from_dict(database))
+    check_schema_version()
+    repostitory = Repostitory(hash_size,
+                              default_toggles,
+                              storage,
+                              GroupHashIndex(hash_index.get("max_memory_mb", 0)),
+                              GroupBloomFilters(bloom_filter.get("enabled", False),
+                                                bloom_filter.get("error_rate", 0.01),
+                                                bloom_filter.get("initial_capacity", 1024)),
+                              NearDuplicateIndex(near_duplicates.get("max_groups", 0),
+                                                 get_near_duplicate_search(near_duplicates.get("search", "bktree"))),
+                              near_duplicates.get("default_threshold", 0),
+                              near_duplicates.get("max_threshold", 0),
+                              image_hashing.get("default_algorithm", DEFAULT_HASH_ALGORITHM),
+                              ImageHasher(hash_size,
+                                          image_hashing.get("executor", "process"),
+                                          image_hashing.get("max_workers", 0),
+                                          image_hashing.get("max_queued", 0),
+                                          image_hashing.get("max_in_memory_kb", 0),
+                                          image_hashing.get("draft_decode", False)),
+                              photo_size_policy,
+                              FileHashCache(file_hash_cache.get("max_entries", 0)),
+                              retention_settings)
     rpb = RepostBot(
         telegram_token,
         bot_strings,
@@ -52,6 +93,9 @@ def main():
         group_whitelist,
         group_blacklist,
         drop_pending_updates,
+        albums.get("window_ms", 0),
+        leaderboard.get("size", 10),
+        [get_stats_window(window) for window in leaderboard.get("windows", [ALL_TIME])],
     )
     rpb.run()
 
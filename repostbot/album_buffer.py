@@ -0,0 +1,50 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Hashable
+
+logger = logging.getLogger("AlbumBuffer")
+
+
+class AlbumBuffer[T]:
+
+    def __init__(self, window_ms: int, process_album: Callable[[list[T]], Awaitable[None]]):
+        self.window = window_ms / 1000
+        self._process_album = process_album
+        self._albums: dict[Hashable, list[T]] = dict()
+        self._timers: dict[Hashable, asyncio.TimerHandle] = dict()
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def add(self, album_id: Hashable, message: T) -> None:
+        self._albums.setdefault(album_id, []).append(message)
+        # telegram sends each picture in an album as its own update, one straight after the other, so the album is
+        # processed once no more have arrived for a whole window
+        timer = self._timers.pop(album_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[album_id] = asyncio.get_running_loop().call_later(self.window, self._start_processing, album_id)
+
+    async def close(self) -> None:
+        for album_id in list(self._albums):
+            self._start_processing(album_id)
+        if len(self._tasks) > 0:
+            await asyncio.gather(*self._tasks)
+
+    def _start_processing(self, album_id: Hashable) -> None:
+        timer = self._timers.pop(album_id, None)
+        if timer is not None:
+            timer.cancel()
+        album = self._albums.pop(album_id)
+        task = asyncio.get_running_loop().create_task(self._process(album))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, album: list[T]) -> None:
+        logger.info(f"Processing album of {len(album)} messages")
+        try:
+            await self._process_album(album)
+        except Exception as e:
+            logger.exception(f"Failed to process album: {e}")
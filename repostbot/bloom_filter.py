@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import math
+from typing import Iterable
+
+logger = logging.getLogger("BloomFilter")
+
+
+class BloomFilter:
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def add(self, item: str) -> None:
+        for index in self._indexes(item):
+            self._bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[index >> 3] & (1 << (index & 7)) for index in self._indexes(item))
+
+    def _indexes(self, item: str) -> Iterable[int]:
+        # double hashing: k indexes from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + i * second) % self.num_bits for i in range(self.num_hashes))
+
+
+class ScalableBloomFilter:
+    _GROWTH = 2
+    _TIGHTENING = 0.5
+
+    def __init__(self, initial_capacity: int, error_rate: float):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self._filters: list[BloomFilter] = []
+
+    def add(self, item: str) -> None:
+        if item in self:
+            return
+        if len(self._filters) == 0 or self._filters[-1].count >= self._filters[-1].capacity:
+            # each new layer is bigger and stricter so the combined false-positive rate stays under error_rate
+            layer = len(self._filters)
+            self._filters.append(BloomFilter(self.initial_capacity * self._GROWTH ** layer,
+                                             self.error_rate * (1 - self._TIGHTENING) * self._TIGHTENING ** layer))
+        self._filters[-1].add(item)
+
+    def __contains__(self, item: str) -> bool:
+        return any(item in bloom_filter for bloom_filter in self._filters)
+
+
+class GroupBloomFilters:
+
+    def __init__(self, enabled: bool, error_rate: float, initial_capacity: int):
+        self.enabled = enabled
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        self.ready = False
+        self.negatives = 0
+        self.positives = 0
+        self.false_positives = 0
+        self._filters: dict[int, ScalableBloomFilter] = dict()
+        self._added_while_building: list[tuple[int, Iterable[str]]] = []
+
+    def might_contain_any(self, group_id: int, hashes: Iterable[str]) -> bool:
+        if not (self.enabled and self.ready):
+            return True
+        group_filter = self._filters.get(group_id)
+        if group_filter is not None and any(entity_hash in group_filter for entity_hash in hashes):
+            self.positives += 1
+            return True
+        self.negatives += 1
+        return False
+
+    def record_false_positive(self) -> None:
+        self.false_positives += 1
+
+    def add(self, group_id: int, hashes: Iterable[str]) -> None:
+        if not self.enabled:
+            return
+        if not self.ready:
+            self._added_while_building.append((group_id, hashes))
+        self._add(self._filters, group_id, hashes)
+
+    def discard(self, group_id: int) -> None:
+        self._filters.pop(group_id, None)
+
+    def build(self, group_hashes: Iterable[tuple[int, str]]) -> dict[int, ScalableBloomFilter]:
+        # runs off the event loop; the result is swapped in with finish_build
+        filters: dict[int, ScalableBloomFilter] = dict()
+        for group_id, entity_hash in group_hashes:
+            self._add(filters, group_id, (entity_hash,))
+        return filters
+
+    def finish_build(self, filters: dict[int, ScalableBloomFilter]) -> None:
+        for group_id, hashes in self._added_while_building:
+            self._add(filters, group_id, hashes)
+        self._added_while_building.clear()
+        self._filters = filters
+        self.ready = True
+        logger.info(f"Bloom filters ready for {len(filters)} groups")
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "negatives": self.negatives,
+            "positives": self.positives,
+            "false_positives": self.false_positives,
+        }
+
+    def _add(self, filters: dict[int, ScalableBloomFilter], group_id: int, hashes: Iterable[str]) -> None:
+        group_filter = filters.get(group_id)
+        if group_filter is None:
+            group_filter = filters[group_id] = ScalableBloomFilter(self.initial_capacity, self.error_rate)
+        for entity_hash in hashes:
+            group_filter.add(entity_hash)
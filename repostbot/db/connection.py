@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager, AbstractContextManager
+from dataclasses import dataclass, fields
+from typing import Any, Iterator
+
+logger = logging.getLogger("Database")
+
+_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    path: str = 'repostdb.sqlite'
+    synchronous: str = 'NORMAL'
+    cache_size_kib: int = 65536
+    mmap_size: int = 268435456
+    busy_timeout_ms: int = 5000
+    cached_statements: int = 256
+    worker_threads: int = 2
+    max_queued_operations: int = 256
+    write_behind: bool = False
+    write_behind_flush_interval_ms: int = 200
+    write_behind_max_rows: int = 500
+    write_behind_max_retries: int = 3
+
+    @staticmethod
+    def from_dict(data: dict[str, Any] | None) -> DatabaseSettings:
+        known_fields = {field.name for field in fields(DatabaseSettings)}
+        settings = DatabaseSettings(**{key: value for key, value in (data or {}).items() if key in known_fields})
+        if settings.synchronous.upper() not in _SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid synchronous mode for database: {settings.synchronous}")
+        return settings
+
+
+# one long-lived connection per thread, all closed together on shutdown
+class ConnectionManager:
+
+    def __init__(self, settings: DatabaseSettings = DatabaseSettings()):
+        self._settings = settings
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self) -> DatabaseSettings:
+        return self._settings
+
+    def configure(self, settings: DatabaseSettings) -> None:
+        self.close_all()
+        self._settings = settings
+        logger.info(f"Using database at {settings.path}")
+
+    def connection(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection | None = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._connect()
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = self.connection()
+        if connection.in_transaction:
+            # join the transaction that's already open on this thread so callers can group several writes together
+            yield connection
+            return
+        connection.execute('begin immediate')
+        try:
+            yield connection
+        except BaseException:
+            connection.rollback()
+            raise
+        else:
+            connection.commit()
+
+    def close_all(self) -> None:
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+        for connection in connections:
+            try:
+                connection.execute('pragma optimize')
+                connection.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing database connection: {e}")
+        self._local = threading.local()
+        if len(connections) > 0:
+            logger.info(f"Closed {len(connections)} database connection(s)")
+
+    def _connect(self) -> sqlite3.Connection:
+        settings = self._settings
+        connection = sqlite3.connect(settings.path,
+                                     timeout=settings.busy_timeout_ms / 1000,
+                                     isolation_level=None,
+                                     check_same_thread=False,
+                                     cached_statements=settings.cached_statements)
+        connection.row_factory = sqlite3.Row
+        connection.execute('pragma journal_mode = WAL')
+        connection.execute(f'pragma synchronous = {settings.synchronous.upper()}')
+        connection.execute(f'pragma cache_size = -{int(settings.cache_size_kib)}')
+        connection.execute(f'pragma mmap_size = {int(settings.mmap_size)}')
+        return connection
+
+
+_manager = ConnectionManager()
+
+
+def configure_database(settings: DatabaseSettings) -> None:
+    _manager.configure(settings)
+
+
+def get_connection() -> sqlite3.Connection:
+    return _manager.connection()
+
+
+def transaction() -> AbstractContextManager[sqlite3.Connection]:
+    return _manager.transaction()
+
+
+def close_database() -> None:
+    _manager.close_all()
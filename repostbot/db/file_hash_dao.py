@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+from sqlite3 import Row
+
+from repostbot.db.connection import get_connection, transaction
+from repostbot.db.hash_encoding import encode_hash, decode_hash
+
+# file_hashes only has a last_used_date column from schema version 7; the bot can run on older ones
+_last_used_tracked = True
+# a hash's last use is written at most this often, so lookups don't all turn into writes
+_LAST_USED_RESOLUTION = timedelta(days=1)
+
+
+def set_file_hash_last_used_tracked(tracked: bool) -> None:
+    global _last_used_tracked
+    _last_used_tracked = tracked
+
+
+class FileHashDAO:
+
+    @staticmethod
+    def get_file_hash(file_unique_id: str, hash_size: int, hash_algorithm: str) -> str | None:
+        cursor = get_connection().cursor()
+        result: Row | None = cursor.execute(
+            '''
+             select hash_value from file_hashes
+             where file_unique_id = ? and hash_size = ? and hash_algorithm = ?
+             ''',
+            (file_unique_id, hash_size, hash_algorithm)
+        ).fetchone()
+        if result is None:
+            return None
+        if _last_used_tracked:
+            FileHashDAO._mark_used(file_unique_id, hash_size, hash_algorithm)
+        return decode_hash(result['hash_value'])
+
+    @staticmethod
+    def insert_file_hash(file_unique_id: str, hash_size: int, hash_algorithm: str, hash_value: str):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            if not _last_used_tracked:
+                cursor.execute(
+                    '''
+                     insert or ignore into file_hashes(file_unique_id, hash_size, hash_algorithm, hash_value)
+                     values (?, ?, ?, ?)
+                     ''',
+                    (file_unique_id, hash_size, hash_algorithm, encode_hash(hash_value))
+                )
+                return
+            cursor.execute(
+                '''
+                 insert or ignore into file_hashes(file_unique_id, hash_size, hash_algorithm, hash_value, last_used_date)
+                 values (?, ?, ?, ?, ?)
+                 ''',
+                (file_unique_id, hash_size, hash_algorithm, encode_hash(hash_value), datetime.now())
+            )
+
+    @staticmethod
+    def remove_file_hashes_unused_since(before: datetime, batch_size: int) -> int:
+        if not _last_used_tracked:
+            return 0
+        # hashes from before last use was tracked go on the first run; they're only a cache
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                '''
+                 delete from file_hashes
+                 where (file_unique_id, hash_size, hash_algorithm) in (
+                     select file_unique_id, hash_size, hash_algorithm from file_hashes
+                     where last_used_date is null or last_used_date < ?
+                     limit ?
+                 )
+                 ''',
+                (before, batch_size)
+            )
+            return cursor.rowcount
+
+    @staticmethod
+    def _mark_used(file_unique_id: str, hash_size: int, hash_algorithm: str):
+        now = datetime.now()
+        stale = get_connection().execute(
+            '''
+             select exists(select 1 from file_hashes
+                           where file_unique_id = ? and hash_size = ? and hash_algorithm = ?
+                           and (last_used_date is null or last_used_date < ?))
+             ''',
+            (file_unique_id, hash_size, hash_algorithm, now - _LAST_USED_RESOLUTION)
+        ).fetchone()[0]
+        if not stale:
+            return
+        with transaction() as connection:
+            connection.execute(
+                '''
+                 update file_hashes set last_used_date = ?
+                 where file_unique_id = ? and hash_size = ? and hash_algorithm = ?
+                 ''',
+                (now, file_unique_id, hash_size, hash_algorithm)
+            )
@@ -0,0 +1,48 @@
+from sqlite3 import Row
+
+from repostbot.db.connection import get_connection, transaction
+from repostbot.db.hash_encoding import encode_hash, decode_hash
+
+
+class ForwardOriginDAO:
+
+    @staticmethod
+    def get_forwarded_hash(group_id: int,
+                           origin_chat_id: int,
+                           origin_message_id: int,
+                           hash_algorithm: str) -> str | None:
+        cursor = get_connection().cursor()
+        result: Row | None = cursor.execute(
+            '''
+             select hash_value from forward_origins
+             where group_id = ? and origin_chat_id = ? and origin_message_id = ? and hash_algorithm = ?
+             ''',
+            (group_id, origin_chat_id, origin_message_id, hash_algorithm)
+        ).fetchone()
+        return decode_hash(result['hash_value']) if result is not None else None
+
+    @staticmethod
+    def insert_forwarded_hash(group_id: int,
+                              origin_chat_id: int,
+                              origin_message_id: int,
+                              hash_algorithm: str,
+                              hash_value: str):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                '''
+                 insert or ignore into forward_origins(group_id, origin_chat_id, origin_message_id, hash_algorithm,
+                                                       hash_value)
+                 values (?, ?, ?, ?, ?)
+                 ''',
+                (group_id, origin_chat_id, origin_message_id, hash_algorithm, encode_hash(hash_value))
+            )
+
+    @staticmethod
+    def remove_all_for_group(group_id: int):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                'delete from forward_origins where group_id = ?',
+                (group_id,)
+            )
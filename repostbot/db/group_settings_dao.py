@@ -0,0 +1,77 @@
+from sqlite3 import Row
+
+from repostbot.db.connection import get_connection, transaction
+from repostbot.group_settings import GroupSettings
+from repostbot.toggles import ToggleType
+
+_TOGGLE_COLUMNS = {
+    ToggleType.PICTURE: 'track_pictures',
+    ToggleType.URL: 'track_urls',
+    ToggleType.AUTOCALLOUT: 'auto_callout',
+    ToggleType.AUTODELETE: 'auto_delete',
+}
+
+
+def _group_settings_from_row(row: Row) -> GroupSettings:
+    # null columns were never set for the group, so the defaults apply to them
+    group_settings = GroupSettings.blank({
+        toggle.value: bool(row[column])
+        for toggle, column in _TOGGLE_COLUMNS.items()
+        if row[column] is not None
+    })
+    if row['image_match_threshold'] is not None:
+        group_settings.image_match_threshold = int(row['image_match_threshold'])
+    if row['hash_algorithm'] is not None:
+        group_settings.hash_algorithm = row['hash_algorithm']
+    if row['retention_days'] is not None:
+        group_settings.retention_days = int(row['retention_days'])
+    if row['retention_max_rows'] is not None:
+        group_settings.retention_max_rows = int(row['retention_max_rows'])
+    return group_settings
+
+
+class GroupSettingsDAO:
+
+    @staticmethod
+    def get_group_settings(group_id: int) -> GroupSettings | None:
+        cursor = get_connection().cursor()
+        result: Row | None = cursor.execute(
+            'select * from group_settings where group_id = ?',
+            (group_id,)
+        ).fetchone()
+        return _group_settings_from_row(result) if result is not None else None
+
+    @staticmethod
+    def save_group_settings(group_id: int, group_settings: GroupSettings):
+        toggles = group_settings.toggles
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                '''
+                 insert into group_settings(group_id, track_pictures, track_urls, auto_callout, auto_delete,
+                                            image_match_threshold, hash_algorithm, retention_days,
+                                            retention_max_rows)
+                 values (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                 on conflict (group_id) do update set
+                     track_pictures = excluded.track_pictures,
+                     track_urls = excluded.track_urls,
+                     auto_callout = excluded.auto_callout,
+                     auto_delete = excluded.auto_delete,
+                     image_match_threshold = excluded.image_match_threshold,
+                     hash_algorithm = excluded.hash_algorithm,
+                     retention_days = excluded.retention_days,
+                     retention_max_rows = excluded.retention_max_rows
+                 ''',
+                (group_id, toggles.track_pictures, toggles.track_urls, toggles.auto_callout, toggles.auto_delete,
+                 group_settings.image_match_threshold, group_settings.hash_algorithm, group_settings.retention_days,
+                 group_settings.retention_max_rows)
+            )
+
+    @staticmethod
+    def remove_group_settings(group_id: int):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                'delete from group_settings where group_id = ?',
+                (group_id,)
+            )
@@ -0,0 +1,72 @@
+from dataclasses import dataclass
+from sqlite3 import Row
+
+from repostbot.db.connection import get_connection, transaction
+
+
+@dataclass(frozen=True)
+class GroupStats:
+    unique_pictures: int = 0
+    picture_reposts: int = 0
+    unique_urls: int = 0
+    url_reposts: int = 0
+
+
+class GroupStatsDAO:
+
+    @staticmethod
+    def get_group_stats(group_id: int) -> GroupStats:
+        cursor = get_connection().cursor()
+        result: Row | None = cursor.execute(
+            '''
+             select unique_pictures, picture_reposts, unique_urls, url_reposts from group_stats
+             where group_id = ?
+             ''',
+            (group_id,)
+        ).fetchone()
+        if result is None:
+            return GroupStats()
+        return GroupStats(result['unique_pictures'], result['picture_reposts'], result['unique_urls'],
+                          result['url_reposts'])
+
+    @staticmethod
+    def add_to_group_stats(group_id: int, stats: GroupStats):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                '''
+                 insert into group_stats(group_id, unique_pictures, picture_reposts, unique_urls, url_reposts)
+                 values (?, ?, ?, ?, ?)
+                 on conflict (group_id) do update set
+                     unique_pictures = unique_pictures + excluded.unique_pictures,
+                     picture_reposts = picture_reposts + excluded.picture_reposts,
+                     unique_urls = unique_urls + excluded.unique_urls,
+                     url_reposts = url_reposts + excluded.url_reposts
+                 ''',
+                (group_id, stats.unique_pictures, stats.picture_reposts, stats.unique_urls, stats.url_reposts)
+            )
+
+    @staticmethod
+    def remove_from_group_stats(group_id: int, stats: GroupStats):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                '''
+                 update group_stats set
+                     unique_pictures = max(unique_pictures - ?, 0),
+                     picture_reposts = max(picture_reposts - ?, 0),
+                     unique_urls = max(unique_urls - ?, 0),
+                     url_reposts = max(url_reposts - ?, 0)
+                 where group_id = ?
+                 ''',
+                (stats.unique_pictures, stats.picture_reposts, stats.unique_urls, stats.url_reposts, group_id)
+            )
+
+    @staticmethod
+    def remove_group_stats(group_id: int):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                'delete from group_stats where group_id = ?',
+                (group_id,)
+            )
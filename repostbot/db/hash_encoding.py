@@ -0,0 +1,29 @@
+# hashes are hex strings everywhere in the bot, and stored as the bytes they spell out
+
+# set from the schema version at startup; databases that haven't reached it still have some stored as text
+_text_hashes_remaining = True
+
+
+def set_text_hashes_remaining(remaining: bool) -> None:
+    global _text_hashes_remaining
+    _text_hashes_remaining = remaining
+
+
+def encode_hash(entity_hash: str) -> bytes:
+    return bytes.fromhex(entity_hash)
+
+
+def decode_hash(stored_hash: bytes | str) -> str:
+    if isinstance(stored_hash, bytes):
+        return stored_hash.hex()
+    # picture hashes used to be stored without padding to a whole byte
+    return stored_hash if len(stored_hash) % 2 == 0 else '0' + stored_hash
+
+
+def stored_forms(entity_hash: str) -> list[bytes | str]:
+    forms: list[bytes | str] = [encode_hash(entity_hash)]
+    if _text_hashes_remaining:
+        forms.append(entity_hash)
+        if entity_hash.startswith('0'):
+            forms.append(entity_hash[1:])
+    return forms
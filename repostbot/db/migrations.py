@@ -0,0 +1,470 @@
+import logging
+import math
+import textwrap
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from sqlite3 import Connection
+from typing import Callable
+
+from repostbot.db.connection import get_connection, transaction
+from repostbot.db.file_hash_dao import set_file_hash_last_used_tracked
+from repostbot.db.hash_encoding import encode_hash, decode_hash, set_text_hashes_remaining
+from repostbot.db.schema_version_dao import SchemaVersionDAO
+
+logger = logging.getLogger("Migrations")
+
+# url hashes are sha256 hex digests
+_URL_HASH_LENGTH = 64
+
+
+@dataclass(frozen=True)
+class MigrationContext:
+    version: int
+    step: int
+    batch_size: int
+    batch_pause_ms: int
+    hash_size: int
+
+    def get_progress(self) -> int | None:
+        return SchemaVersionDAO.get_progress(self.version, self.step)
+
+    def save_progress(self, position: int) -> None:
+        SchemaVersionDAO.save_progress(self.version, self.step, position)
+
+    def pause(self) -> None:
+        # lets the bot's own writes in between batches
+        time.sleep(self.batch_pause_ms / 1000)
+
+
+# every step can be run again, whether it finished or was interrupted part of the way through
+class MigrationStep(ABC):
+
+    @abstractmethod
+    def run(self, context: MigrationContext) -> None:
+        pass
+
+
+class SqlStep(MigrationStep):
+    def __init__(self, *statements: str):
+        self.statements = [textwrap.dedent(statement) for statement in statements]
+
+    def run(self, context: MigrationContext) -> None:
+        with transaction() as connection:
+            for statement in self.statements:
+                connection.execute(statement)
+
+
+class CheckRepostKindsDecidable(MigrationStep):
+    # 0.6.0 stored picture and url hashes side by side as hex text without saying which is which. url hashes are
+    # sha256 digests, so a picture can only be told apart from a url when its hashes are a different length
+    def run(self, context: MigrationContext) -> None:
+        if not repost_kinds_ambiguous(context.hash_size):
+            return
+        connection = get_connection()
+        columns = {row['name'] for row in connection.execute('pragma table_info(reposts)')}
+        # when it's run again, rows that were already sorted out or that have an algorithm stored are fine
+        conditions = [f'length(hash_value) = {_URL_HASH_LENGTH}',
+                      *(f'{column} is null' for column in ('kind', 'hash_algorithm') if column in columns)]
+        ambiguous_rows = connection.execute(
+            f'select exists(select 1 from reposts where {" and ".join(conditions)})'
+        ).fetchone()[0]
+        if ambiguous_rows:
+            raise RuntimeError(f"With hash_size {context.hash_size}, picture hashes stored before schema versions "
+                               f"were tracked are {_URL_HASH_LENGTH} characters long, the same as URL hashes, so "
+                               f"they can't be told apart. Nothing has been changed. Start a new database with "
+                               f"scripts/init_db.py instead")
+
+
+class AddColumn(MigrationStep):
+    def __init__(self, table: str, column: str, definition: str):
+        self.table = table
+        self.column = column
+        self.definition = definition
+
+    def run(self, context: MigrationContext) -> None:
+        with transaction() as connection:
+            columns = {row['name'] for row in connection.execute(f'pragma table_info({self.table})')}
+            if self.column not in columns:
+                connection.execute(f'alter table {self.table} add column {self.column} {self.definition}')
+
+
+class BatchedUpdate(MigrationStep):
+    # the update is run over one range of ids at a time
+    def __init__(self, table: str, update_sql: str):
+        self.table = table
+        self.update_sql = textwrap.dedent(update_sql)
+
+    def run(self, context: MigrationContext) -> None:
+        position = context.get_progress() or 0
+        max_id = get_connection().execute(f'select coalesce(max(id), 0) from {self.table}').fetchone()[0]
+        while position < max_id:
+            with transaction() as connection:
+                connection.execute(self.update_sql, (position, position + context.batch_size))
+                position += context.batch_size
+                context.save_progress(position)
+            context.pause()
+
+
+class ConvertHashes(MigrationStep):
+    # walks the table in key order; rows that are already converted are skipped when it's run again
+    def __init__(self, table: str, keys: list[str]):
+        self.table = table
+        self.keys = keys
+
+    def run(self, context: MigrationContext) -> None:
+        key_columns = ', '.join(self.keys)
+        key_placeholders = ', '.join('?' for _ in self.keys)
+        last_key: tuple | None = None
+        while True:
+            with transaction() as connection:
+                rows = connection.execute(
+                    f'''
+                     select {key_columns}, hash_value from {self.table}
+                     {f'where ({key_columns}) > ({key_placeholders})' if last_key is not None else ''}
+                     order by {key_columns}
+                     limit ?
+                     ''',
+                    (*(last_key or ()), context.batch_size)
+                ).fetchall()
+                if len(rows) == 0:
+                    break
+                # a row the bot has stored again as bytes since is the same row, so the old one gives way
+                connection.executemany(
+                    f'update or replace {self.table} set hash_value = ? '
+                    f'where ({key_columns}) = ({key_placeholders})',
+                    ((encode_hash(decode_hash(row['hash_value'])), *tuple(row)[:-1])
+                     for row in rows if isinstance(row['hash_value'], str))
+                )
+                last_key = tuple(rows[-1])[:-1]
+            context.pause()
+
+
+# sqlite builds an index in one statement that holds the write lock until it's done. instead, the table is copied
+# into a new one that already has the new indexes a batch at a time, while triggers keep the copy in step with whatever
+# the bot writes in the meantime. once everything is copied, the new table takes the old one's place.
+# the table needs an INTEGER primary key named id
+class RebuildTable(MigrationStep):
+    def __init__(self,
+                 table: str,
+                 create_sql: str,
+                 index_sql: dict[str, str],
+                 columns: list[str],
+                 convert_row: Callable[[tuple], tuple] = lambda row: row):
+        self.table = table
+        self.rebuild = f'{table}_rebuild'
+        self.create_sql = textwrap.dedent(create_sql).format(table=self.rebuild)
+        self.index_sql = {name: textwrap.dedent(sql).format(table=self.rebuild) for name, sql in index_sql.items()}
+        self.columns = columns
+        self.convert_row = convert_row
+
+    def run(self, context: MigrationContext) -> None:
+        position = context.get_progress()
+        if position is None:
+            with transaction() as connection:
+                self._start(connection)
+                position = 0
+                context.save_progress(position)
+        column_list = ', '.join(self.columns)
+        placeholders = ', '.join('?' for _ in self.columns)
+        batches = 0
+        while True:
+            with transaction() as connection:
+                rows = connection.execute(
+                    f'select {column_list} from {self.table} where id > ? order by id limit ?',
+                    (position, context.batch_size)
+                ).fetchall()
+                if len(rows) == 0:
+                    self._swap(connection)
+                    break
+                # rows the triggers copied already are newer than these
+                connection.executemany(
+                    f'insert or ignore into {self.rebuild}({column_list}) values ({placeholders})',
+                    (self.convert_row(tuple(row)) for row in rows)
+                )
+                position = rows[-1]['id']
+                context.save_progress(position)
+            batches += 1
+            if batches % 100 == 0:
+                logger.info(f"Copied {self.table} up to id {position}")
+            context.pause()
+
+    def _start(self, connection: Connection) -> None:
+        for name in self.index_sql:
+            # an index an earlier migration put on the old table can share a name with one of the new table's. the
+            # old table's goes now instead of at the swap, so the new one needs to be covered by what's left until then
+            connection.execute(f'drop index if exists {name}')
+        connection.execute(self.create_sql)
+        for sql in self.index_sql.values():
+            connection.execute(sql)
+        column_list = ', '.join(self.columns)
+        new_values = ', '.join(f'new.{column}' for column in self.columns)
+        connection.execute(
+            f'''
+             create trigger {self.rebuild}_insert after insert on {self.table}
+             begin
+                 insert or replace into {self.rebuild}({column_list}) values ({new_values});
+             end
+             '''
+        )
+        connection.execute(
+            f'''
+             create trigger {self.rebuild}_update after update on {self.table}
+             begin
+                 delete from {self.rebuild} where id = old.id;
+                 insert or replace into {self.rebuild}({column_list}) values ({new_values});
+             end
+             '''
+        )
+        connection.execute(
+            f'''
+             create trigger {self.rebuild}_delete after delete on {self.table}
+             begin
+                 delete from {self.rebuild} where id = old.id;
+             end
+             '''
+        )
+
+    def _swap(self, connection: Connection) -> None:
+        for trigger in ['insert', 'update', 'delete']:
+            connection.execute(f'drop trigger {self.rebuild}_{trigger}')
+        # ids that were handed out and deleted since aren't handed out again
+        if connection.execute(
+                'update sqlite_sequence set seq = (select max(seq) from sqlite_sequence where name in (?, ?)) '
+                'where name = ?',
+                (self.table, self.rebuild, self.rebuild)
+        ).rowcount == 0:
+            connection.execute(
+                'insert into sqlite_sequence(name, seq) select ?, seq from sqlite_sequence where name = ?',
+                (self.rebuild, self.table)
+            )
+        connection.execute(f'drop table {self.table}')
+        connection.execute(f'alter table {self.rebuild} rename to {self.table}')
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    steps: tuple[MigrationStep, ...]
+
+
+def _repost_with_hash_bytes(row: tuple) -> tuple:
+    repost_id, group_id, user_id, message_id, hash_value, hash_checked_date, hash_algorithm, kind = row
+    if kind is None:
+        # url hashes are sha256 hex digests. pictures are any other length, or have an algorithm stored with them
+        kind = 'picture' if hash_algorithm is not None or len(decode_hash(hash_value)) != _URL_HASH_LENGTH else 'url'
+    return (repost_id, group_id, user_id, message_id, encode_hash(decode_hash(hash_value)), hash_checked_date,
+            hash_algorithm, kind)
+
+
+_COUNT_GROUP_STATS = """
+    insert or replace into group_stats(group_id, unique_pictures, picture_reposts, unique_urls, url_reposts)
+    select group_id,
+           count(distinct case when kind = 'picture' then hash_value end),
+           sum(kind = 'picture') - count(distinct case when kind = 'picture' then hash_value end),
+           count(distinct case when kind = 'url' then hash_value end),
+           sum(kind = 'url') - count(distinct case when kind = 'url' then hash_value end)
+    from reposts
+    group by group_id
+"""
+
+# a row is a repost when the group already had its hash
+_COUNT_USER_REPOSTS = ("""
+    delete from user_reposts
+""", """
+    insert into user_reposts(group_id, user_id, day, reposts)
+    select group_id, user_id, date(hash_checked_date), count(*)
+    from (
+        select group_id,
+               user_id,
+               hash_checked_date,
+               row_number() over (partition by group_id, hash_value order by id) as seen
+        from reposts
+    )
+    where seen > 1 and user_id is not null
+    group by group_id, user_id, date(hash_checked_date)
+""")
+
+
+def recount_reposts() -> None:
+    # the counters only follow reposts the bot stores itself, so they're counted from scratch after an import
+    with transaction() as connection:
+        for statement in (_COUNT_GROUP_STATS, *_COUNT_USER_REPOSTS):
+            connection.execute(statement)
+
+
+# in order; the schema scripts/init_db.py creates is the one they all add up to
+MIGRATIONS = [
+    Migration(1, "repost lookup indexes, picture hash algorithms and repost kinds", (
+        CheckRepostKindsDecidable(),
+        # repost lookups read only the rows for the hashes in a message, and retention walks each group in id order.
+        # the bot can run from version 5, so these have to be here before migration 6 rebuilds the table
+        SqlStep("""
+            create index if not exists reposts_group_id_hash_value_index
+                on reposts (group_id, hash_value)
+        """, """
+            create index if not exists reposts_group_id_id_index
+                on reposts (group_id, id)
+        """),
+        AddColumn('reposts', 'hash_algorithm', 'TEXT'),
+        AddColumn('reposts', 'kind', 'TEXT'),
+        BatchedUpdate('reposts', """
+            update reposts
+            set kind = case when hash_algorithm is not null or length(hash_value) != 64 then 'picture' else 'url' end
+            where id > ? and id <= ? and kind is null
+        """),
+    )),
+    Migration(2, "file hash and forwarded post caches", (
+        SqlStep("""
+            create table if not exists file_hashes(
+                file_unique_id TEXT not null,
+                hash_size      INTEGER not null,
+                hash_algorithm TEXT not null,
+                hash_value     BLOB not null,
+                primary key (file_unique_id, hash_size, hash_algorithm)
+            ) without rowid
+        """, """
+            create table if not exists forward_origins(
+                group_id          INTEGER not null,
+                origin_chat_id    INTEGER not null,
+                origin_message_id INTEGER not null,
+                hash_algorithm    TEXT not null,
+                hash_value        BLOB not null,
+                primary key (group_id, origin_chat_id, origin_message_id, hash_algorithm)
+            ) without rowid
+        """),
+    )),
+    Migration(3, "group settings", (
+        SqlStep("""
+            create table if not exists group_settings(
+                group_id              INTEGER not null primary key,
+                track_pictures        INTEGER,
+                track_urls            INTEGER,
+                auto_callout          INTEGER,
+                auto_delete           INTEGER,
+                image_match_threshold INTEGER,
+                hash_algorithm        TEXT,
+                retention_days        INTEGER,
+                retention_max_rows    INTEGER
+            )
+        """),
+        AddColumn('group_settings', 'retention_days', 'INTEGER'),
+        AddColumn('group_settings', 'retention_max_rows', 'INTEGER'),
+    )),
+    Migration(4, "group stats counters", (
+        SqlStep("""
+            create table if not exists group_stats(
+                group_id        INTEGER not null primary key,
+                unique_pictures INTEGER not null default 0,
+                picture_reposts INTEGER not null default 0,
+                unique_urls     INTEGER not null default 0,
+                url_reposts     INTEGER not null default 0
+            )
+        """, _COUNT_GROUP_STATS),
+    )),
+    Migration(5, "per-user daily repost counts", (
+        SqlStep("""
+            create table if not exists user_reposts(
+                group_id INTEGER not null,
+                user_id  INTEGER not null,
+                day      TEXT not null,
+                reposts  INTEGER not null default 0,
+                primary key (group_id, user_id, day)
+            ) without rowid
+        """, """
+            create index if not exists user_reposts_group_id_day_index
+                on user_reposts (group_id, day, user_id, reposts)
+        """, *_COUNT_USER_REPOSTS),
+    )),
+    Migration(6, "hashes stored as bytes, with a covering (group_id, kind, hash_value) index", (
+        RebuildTable(
+            'reposts',
+            """
+                create table {table}(
+                    id                INTEGER not null primary key autoincrement,
+                    group_id          INTEGER not null,
+                    user_id           INTEGER,
+                    message_id        INTEGER not null,
+                    hash_value        BLOB not null,
+                    hash_checked_date DATE,
+                    hash_algorithm    TEXT,
+                    kind              TEXT
+                )
+            """,
+            {
+                # takes migration 1's index of the same name from the old table, whose (group_id) index from 0.6.0
+                # keeps the same order for the bot while the copy runs
+                'reposts_group_id_id_index': 'create index reposts_group_id_id_index on {table} (group_id, id)',
+                'reposts_group_id_kind_hash_value_index': """
+                    create index reposts_group_id_kind_hash_value_index
+                        on {table} (group_id, kind, hash_value, message_id)
+                """,
+                'reposts_group_id_message_id_hash_value_unique': """
+                    create unique index reposts_group_id_message_id_hash_value_unique
+                        on {table} (group_id, message_id, hash_value)
+                """,
+            },
+            ['id', 'group_id', 'user_id', 'message_id', 'hash_value', 'hash_checked_date', 'hash_algorithm', 'kind'],
+            _repost_with_hash_bytes
+        ),
+        ConvertHashes('hash_whitelist', ['id']),
+        ConvertHashes('forward_origins', ['group_id', 'origin_chat_id', 'origin_message_id', 'hash_algorithm']),
+        ConvertHashes('file_hashes', ['file_unique_id', 'hash_size', 'hash_algorithm']),
+    )),
+    Migration(7, "file hash last use and forward origins by hash, for retention", (
+        AddColumn('file_hashes', 'last_used_date', 'DATE'),
+        # both tables hold at most one row per picture file or forwarded post, so these are quick to build
+        SqlStep("""
+            create index if not exists file_hashes_last_used_date_index
+                on file_hashes (last_used_date)
+        """, """
+            create index if not exists forward_origins_group_id_hash_value_index
+                on forward_origins (group_id, hash_value)
+        """),
+    )),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1].version
+# the bot can run while the migrations after this one are applied
+REQUIRED_SCHEMA_VERSION = 5
+_HASHES_AS_BYTES_VERSION = 6
+_FILE_HASH_LAST_USED_VERSION = 7
+
+
+def repost_kinds_ambiguous(hash_size: int) -> bool:
+    # imagehash wrote a hex digit for every 4 bits of a picture hash
+    return math.ceil(hash_size ** 2 / 4) == _URL_HASH_LENGTH
+
+
+def apply_migrations(batch_size: int,
+                     batch_pause_ms: int,
+                     hash_size: int,
+                     target_version: int = LATEST_SCHEMA_VERSION) -> int:
+    SchemaVersionDAO.create_tables()
+    version = SchemaVersionDAO.get_schema_version()
+    for migration in MIGRATIONS:
+        if migration.version <= version or migration.version > target_version:
+            continue
+        logger.info(f"Migrating to schema version {migration.version}: {migration.description}")
+        for step, migration_step in enumerate(migration.steps):
+            migration_step.run(MigrationContext(migration.version, step, batch_size, batch_pause_ms, hash_size))
+        SchemaVersionDAO.record_schema_version(migration.version, migration.description)
+        version = migration.version
+    return version
+
+
+def check_schema_version() -> int:
+    version = SchemaVersionDAO.get_schema_version()
+    if version > LATEST_SCHEMA_VERSION:
+        raise RuntimeError(f"The database's schema version is {version}, but this version of the bot only knows up "
+                           f"to {LATEST_SCHEMA_VERSION}")
+    if version < REQUIRED_SCHEMA_VERSION:
+        raise RuntimeError(f"The database's schema version is {version}, but the bot needs at least "
+                           f"{REQUIRED_SCHEMA_VERSION}. Run scripts/migrate.py")
+    if version < LATEST_SCHEMA_VERSION:
+        logger.warning(f"The database's schema version is {version}. The rest of the migrations up to "
+                       f"{LATEST_SCHEMA_VERSION} can be applied with scripts/migrate.py while the bot is running")
+    set_text_hashes_remaining(version < _HASHES_AS_BYTES_VERSION)
+    set_file_hash_last_used_tracked(version >= _FILE_HASH_LAST_USED_VERSION)
+    return version
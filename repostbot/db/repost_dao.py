@@ -1,48 +1,147 @@
-import itertools
-import sqlite3
+from dataclasses import dataclass
 from datetime import datetime
+from enum import Enum
 from sqlite3 import Row
-from typing import Iterable, Callable
+from typing import Iterable, Iterator
 
+from repostbot.db.connection import get_connection, transaction
+from repostbot.db.group_stats_dao import GroupStats, GroupStatsDAO
+from repostbot.db.hash_encoding import encode_hash, decode_hash, stored_forms
+from repostbot.db.user_stats_dao import UserStatsDAO
 
-def group_by[T, K, V](iterable: Iterable[T],
-                      key_mapper: Callable[[T], K],
-                      value_mapper: Callable[[T], V] = lambda value: value) -> dict[K, list[V]]:
-    return {
-        key: [value_mapper(item) for item in values]
-        for key, values
-        in itertools.groupby(iterable, key_mapper)
-    }
+
+def _message_ids_by_hash(rows: Iterable[Row]) -> dict[str, list[int]]:
+    # rows come in id order; a hash can still be stored both as text and as bytes until it's migrated
+    reposts: dict[str, list[int]] = dict()
+    for row in rows:
+        reposts.setdefault(decode_hash(row['hash_value']), []).append(int(row['message_id']))
+    return reposts
+
+
+class RepostKind(Enum):
+    PICTURE = 'picture'
+    URL = 'url'
+
+
+@dataclass(frozen=True)
+class NewRepost:
+    user_id: int
+    message_id: int
+    hashes: frozenset[str]
+    image_hash: str | None = None
+    hash_algorithm: str | None = None
 
 
 class RepostDAO:
 
     @staticmethod
     def get_group_reposts(group_id: int) -> dict[str, list[int]]:
-        with sqlite3.connect('repostdb.sqlite') as connection:
-            connection.row_factory = sqlite3.Row
-            cursor = connection.cursor()
-            repost_result: list[Row] = cursor.execute(
-                'select hash_value, message_id from reposts where group_id = ? order by hash_value',
-                (group_id,)
-            ).fetchall()
-            return group_by(repost_result, lambda row: row['hash_value'], lambda row: int(row['message_id']))
+        cursor = get_connection().cursor()
+        repost_result: list[Row] = cursor.execute(
+            'select hash_value, message_id from reposts where group_id = ? order by id',
+            (group_id,)
+        ).fetchall()
+        return _message_ids_by_hash(repost_result)
+
+    @staticmethod
+    def get_group_picture_hashes(group_id: int, hash_algorithm: str, include_unrecorded: bool) -> set[str]:
+        cursor = get_connection().cursor()
+        result: list[Row] = cursor.execute(
+            '''
+             select distinct hash_value from reposts
+             where group_id = ? and kind = ? and (hash_algorithm = ? or (? and hash_algorithm is null))
+             ''',
+            (group_id, RepostKind.PICTURE.value, hash_algorithm, include_unrecorded)
+        ).fetchall()
+        return {decode_hash(row['hash_value']) for row in result}
 
     @staticmethod
-    def insert_reposts_for_group(group_id: int, user_id: int, message_id: int, hashes: Iterable[str]):
-        with sqlite3.connect('repostdb.sqlite') as connection:
+    def get_all_group_hashes() -> Iterator[tuple[int, str]]:
+        cursor = get_connection().cursor()
+        for row in cursor.execute('select distinct group_id, hash_value from reposts'):
+            yield int(row['group_id']), decode_hash(row['hash_value'])
+
+    @staticmethod
+    def get_reposts_for_hashes(group_id: int, hashes: Iterable[str]) -> dict[str, list[int]]:
+        stored_hashes = [stored_hash for entity_hash in hashes for stored_hash in stored_forms(entity_hash)]
+        if len(stored_hashes) == 0:
+            return dict()
+        cursor = get_connection().cursor()
+        placeholders = ', '.join('?' for _ in stored_hashes)
+        # listing every kind lets the lookup use the (group_id, kind, hash_value) index. sorting here instead of in
+        # the query keeps the planner from picking the (group_id, id) index to get the order for free
+        repost_result: list[Row] = cursor.execute(
+            f'''
+             select id, hash_value, message_id from reposts
+             where group_id = ? and kind in (?, ?) and hash_value in ({placeholders})
+             ''',
+            (group_id, RepostKind.PICTURE.value, RepostKind.URL.value, *stored_hashes)
+        ).fetchall()
+        return _message_ids_by_hash(sorted(repost_result, key=lambda row: row['id']))
+
+    @staticmethod
+    def insert_reposts_for_group(group_id: int,
+                                 user_id: int,
+                                 message_id: int,
+                                 hashes: Iterable[str],
+                                 checked_date: datetime | None = None,
+                                 image_hash: str | None = None,
+                                 hash_algorithm: str | None = None):
+        with transaction() as connection:
             cursor = connection.cursor()
-            now = datetime.now()
-            cursor.executemany(
-                '''
-                 insert into reposts(group_id, user_id, message_id, hash_value, hash_checked_date)
-                 values (?, ?, ?, ?, ?)
-                 ''',
-                ((group_id, user_id, message_id, hash_value, now) for hash_value in hashes))
+            checked_date = checked_date if checked_date is not None else datetime.now()
+            unique = {RepostKind.PICTURE: 0, RepostKind.URL: 0}
+            reposted = {RepostKind.PICTURE: 0, RepostKind.URL: 0}
+            for hash_value in hashes:
+                kind = RepostKind.PICTURE if hash_value == image_hash else RepostKind.URL
+                forms = stored_forms(hash_value)
+                seen_before = cursor.execute(
+                    f'''
+                     select exists(select 1 from reposts
+                                   where group_id = ? and kind = ? and hash_value in ({', '.join('?' for _ in forms)}))
+                     ''',
+                    (group_id, kind.value, *forms)
+                ).fetchone()[0]
+                cursor.execute(
+                    '''
+                     insert or ignore into reposts(group_id, user_id, message_id, hash_value, hash_checked_date,
+                                                   hash_algorithm, kind)
+                     values (?, ?, ?, ?, ?, ?, ?)
+                     ''',
+                    (group_id, user_id, message_id, encode_hash(hash_value), checked_date,
+                     hash_algorithm if kind is RepostKind.PICTURE else None, kind.value)
+                )
+                # rows that were already stored don't count twice
+                if cursor.rowcount > 0:
+                    (reposted if seen_before else unique)[kind] += 1
+            GroupStatsDAO.add_to_group_stats(group_id, GroupStats(unique[RepostKind.PICTURE],
+                                                                  reposted[RepostKind.PICTURE],
+                                                                  unique[RepostKind.URL],
+                                                                  reposted[RepostKind.URL]))
+            user_reposts = sum(reposted.values())
+            if user_id is not None and user_reposts > 0:
+                UserStatsDAO.add_user_reposts(group_id, user_id, checked_date.date(), user_reposts)
+
+    @staticmethod
+    def insert_reposts_for_messages(group_id: int, reposts: Iterable[NewRepost]):
+        with transaction():
+            for repost in reposts:
+                RepostDAO.insert_reposts_for_group(group_id, repost.user_id, repost.message_id, repost.hashes,
+                                                   image_hash=repost.image_hash, hash_algorithm=repost.hash_algorithm)
+
+    @staticmethod
+    def insert_and_get_reposts_for_messages(group_id: int, reposts: Iterable[NewRepost]) -> dict[str, list[int]]:
+        reposts = list(reposts)
+        hashes = set().union(*(repost.hashes for repost in reposts))
+        if len(hashes) == 0:
+            return dict()
+        with transaction():
+            RepostDAO.insert_reposts_for_messages(group_id, reposts)
+            return RepostDAO.get_reposts_for_hashes(group_id, hashes)
 
     @staticmethod
     def remove_all_for_group(group_id: int):
-        with sqlite3.connect('repostdb.sqlite') as connection:
+        with transaction() as connection:
             cursor = connection.cursor()
             cursor.execute(
                 'delete from reposts where group_id = ?',
@@ -0,0 +1,134 @@
+from collections import Counter
+from datetime import date, datetime
+from sqlite3 import Cursor, Row
+
+from repostbot.db.connection import get_connection, transaction
+from repostbot.db.group_stats_dao import GroupStats, GroupStatsDAO
+from repostbot.db.hash_encoding import decode_hash, stored_forms
+from repostbot.db.user_stats_dao import UserStatsDAO
+
+# rows of each index analyze looks at; a few hundred is enough for the planner, and reading every row of a big
+# database would hold the write lock for the whole run
+_ANALYSIS_LIMIT = 400
+
+
+class RetentionDAO:
+
+    @staticmethod
+    def get_group_ids() -> list[int]:
+        cursor = get_connection().cursor()
+        return [int(row['group_id']) for row in cursor.execute('select group_id from group_stats')]
+
+    @staticmethod
+    def get_cutoff_id(group_id: int, before: datetime | None, keep_rows: int | None) -> int | None:
+        # reposts are stored in the order they come in, so everything older than the cutoff has a lower id
+        cursor = get_connection().cursor()
+        cutoff_ids = []
+        if before is not None:
+            result: Row | None = cursor.execute(
+                '''
+                 select coalesce(
+                     (select id from reposts where group_id = ? and hash_checked_date >= ? order by id limit 1),
+                     (select max(id) + 1 from reposts where group_id = ?)
+                 ) as id
+                 ''',
+                (group_id, before, group_id)
+            ).fetchone()
+            cutoff_ids.append(result['id'])
+        if keep_rows is not None:
+            result: Row | None = cursor.execute(
+                'select id from reposts where group_id = ? order by id desc limit 1 offset ?',
+                (group_id, keep_rows - 1)
+            ).fetchone()
+            cutoff_ids.append(result['id'] if result is not None else None)
+        cutoff_ids = [cutoff_id for cutoff_id in cutoff_ids if cutoff_id is not None]
+        return max(cutoff_ids) if len(cutoff_ids) > 0 else None
+
+    @staticmethod
+    def remove_reposts_before(group_id: int, cutoff_id: int, batch_size: int) -> int:
+        with transaction() as connection:
+            cursor = connection.cursor()
+            batch: list[Row] = cursor.execute(
+                '''
+                 select id, user_id, message_id, hash_value, hash_checked_date, kind from reposts
+                 where group_id = ? and id < ? order by id limit ?
+                 ''',
+                (group_id, cutoff_id, batch_size)
+            ).fetchall()
+            if len(batch) == 0:
+                return 0
+            gone_pictures = RetentionDAO._remove_from_stats(cursor, group_id, batch)
+            cursor.execute(
+                'delete from reposts where group_id = ? and id <= ?',
+                (group_id, batch[-1]['id'])
+            )
+            # a forwarded post's hash is only worth keeping while the group still has a picture with it
+            cursor.executemany(
+                'delete from forward_origins where group_id = ? and hash_value = ?',
+                ((group_id, stored_form)
+                 for hash_value in gone_pictures
+                 for stored_form in stored_forms(decode_hash(hash_value)))
+            )
+            # a message's deleted record is only needed while some of its reposts are still stored
+            cursor.executemany(
+                '''
+                 delete from deleted_messages
+                 where group_id = ? and message_id = ?
+                 and not exists (select 1 from reposts where group_id = ? and message_id = ?)
+                 ''',
+                ((group_id, message_id, group_id, message_id) for message_id in {row['message_id'] for row in batch})
+            )
+            return len(batch)
+
+    @staticmethod
+    def _remove_from_stats(cursor: Cursor, group_id: int, batch: list[Row]) -> list[bytes | str]:
+        # the batch is every row of the group up to its last id, so the first row of each hash in it is the one
+        # that was counted as unique, and the rest were counted as reposts
+        rows_by_hash: dict[tuple[str, bytes | str], list[Row]] = dict()
+        for row in batch:
+            rows_by_hash.setdefault((row['kind'], row['hash_value']), []).append(row)
+        unique = Counter()
+        reposted = Counter()
+        user_reposts: Counter[tuple[int, date]] = Counter()
+        gone_pictures = []
+        for (kind, hash_value), rows in rows_by_hash.items():
+            reposted[kind] += len(rows) - 1
+            user_reposts.update(_user_day(row) for row in rows[1:] if row['user_id'] is not None)
+            next_row: Row | None = cursor.execute(
+                '''
+                 select user_id, hash_checked_date from reposts
+                 where group_id = ? and kind = ? and hash_value = ? and id > ?
+                 order by id limit 1
+                 ''',
+                (group_id, kind, hash_value, batch[-1]['id'])
+            ).fetchone()
+            if next_row is None:
+                unique[kind] += 1
+                if kind == 'picture':
+                    gone_pictures.append(hash_value)
+            else:
+                # the hash's first row from now on, which isn't a repost any more
+                reposted[kind] += 1
+                if next_row['user_id'] is not None:
+                    user_reposts[_user_day(next_row)] += 1
+        GroupStatsDAO.remove_from_group_stats(group_id, GroupStats(unique['picture'], reposted['picture'],
+                                                                   unique['url'], reposted['url']))
+        for (user_id, day), reposts in user_reposts.items():
+            UserStatsDAO.remove_user_reposts(group_id, user_id, day, reposts)
+        return gone_pictures
+
+    @staticmethod
+    def analyze():
+        connection = get_connection()
+        connection.execute(f'pragma analysis_limit = {_ANALYSIS_LIMIT}')
+        connection.execute('analyze')
+
+    @staticmethod
+    def incremental_vacuum(pages: int):
+        # only frees pages when the database was created with auto_vacuum = incremental; otherwise it does nothing.
+        # execute() would only step it once and free a single page, executescript() runs it to the end
+        get_connection().executescript(f'pragma incremental_vacuum({int(pages)});')
+
+
+def _user_day(row: Row) -> tuple[int, date]:
+    return int(row['user_id']), datetime.fromisoformat(str(row['hash_checked_date'])).date()
@@ -0,0 +1,77 @@
+from datetime import datetime
+from sqlite3 import Row
+
+from repostbot.db.connection import get_connection, transaction
+
+
+class SchemaVersionDAO:
+
+    @staticmethod
+    def create_tables():
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                '''
+                 create table if not exists schema_version(
+                     version      INTEGER not null primary key,
+                     description  TEXT not null,
+                     applied_date DATE not null
+                 )
+                 '''
+            )
+            # how far each batched step of a migration that hasn't finished has got
+            cursor.execute(
+                '''
+                 create table if not exists schema_migration_progress(
+                     version  INTEGER not null,
+                     step     INTEGER not null,
+                     position INTEGER not null,
+                     primary key (version, step)
+                 ) without rowid
+                 '''
+            )
+
+    @staticmethod
+    def get_schema_version() -> int:
+        cursor = get_connection().cursor()
+        exists = cursor.execute(
+            "select exists(select 1 from sqlite_master where type = 'table' and name = 'schema_version')"
+        ).fetchone()[0]
+        if not exists:
+            # databases from before migrations were tracked start at 0.6.0's schema
+            return 0
+        return int(cursor.execute('select coalesce(max(version), 0) from schema_version').fetchone()[0])
+
+    @staticmethod
+    def record_schema_version(version: int, description: str):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                'insert into schema_version(version, description, applied_date) values (?, ?, ?)',
+                (version, description, datetime.now())
+            )
+            cursor.execute(
+                'delete from schema_migration_progress where version = ?',
+                (version,)
+            )
+
+    @staticmethod
+    def get_progress(version: int, step: int) -> int | None:
+        cursor = get_connection().cursor()
+        result: Row | None = cursor.execute(
+            'select position from schema_migration_progress where version = ? and step = ?',
+            (version, step)
+        ).fetchone()
+        return int(result['position']) if result is not None else None
+
+    @staticmethod
+    def save_progress(version: int, step: int, position: int):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                '''
+                 insert into schema_migration_progress(version, step, position) values (?, ?, ?)
+                 on conflict (version, step) do update set position = excluded.position
+                 ''',
+                (version, step, position)
+            )
@@ -0,0 +1,266 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from functools import partial
+from typing import Callable, Iterable, Iterator
+
+from repostbot.db.connection import DatabaseSettings, configure_database, close_database, transaction
+from repostbot.db.deleted_messages_dao import DeletedMessagesDAO
+from repostbot.db.file_hash_dao import FileHashDAO
+from repostbot.db.forward_origin_dao import ForwardOriginDAO
+from repostbot.db.group_stats_dao import GroupStatsDAO, GroupStats
+from repostbot.db.group_settings_dao import GroupSettingsDAO
+from repostbot.db.hash_whitelist_dao import HashWhitelistDAO
+from repostbot.db.repost_dao import RepostDAO, NewRepost
+from repostbot.db.retention_dao import RetentionDAO
+from repostbot.db.user_stats_dao import UserStatsDAO, UserReposts
+from repostbot.db.write_behind import WriteBehindBuffer, PendingWrite, PendingRepost, PendingDeletedMessages, \
+    PendingWhitelistInsert, PendingWhitelistClear
+from repostbot.group_settings import GroupSettings
+
+logger = logging.getLogger("RepostStorage")
+
+
+def _remove_all_for_group(group_id: int) -> None:
+    with transaction():
+        RepostDAO.remove_all_for_group(group_id)
+        HashWhitelistDAO.remove_all_whitelist_hashes_for_group(group_id)
+        DeletedMessagesDAO.remove_all_deleted_message_records_for_group(group_id)
+        ForwardOriginDAO.remove_all_for_group(group_id)
+        GroupSettingsDAO.remove_group_settings(group_id)
+        GroupStatsDAO.remove_group_stats(group_id)
+        UserStatsDAO.remove_all_for_group(group_id)
+
+
+def _apply_writes(writes: list[PendingWrite]) -> None:
+    with transaction():
+        for write in writes:
+            write.apply()
+
+
+def _pending_repost(group_id: int, repost: NewRepost) -> PendingRepost:
+    return PendingRepost(group_id, repost.user_id, repost.message_id, repost.hashes, repost.image_hash,
+                         repost.hash_algorithm)
+
+
+def _merge_message_ids(*message_id_lists: list[int]) -> list[int]:
+    return list(dict.fromkeys(message_id for message_ids in message_id_lists for message_id in message_ids))
+
+
+class RepostStorage:
+
+    def __init__(self, settings: DatabaseSettings):
+        configure_database(settings)
+        self._executor = ThreadPoolExecutor(max_workers=settings.worker_threads, thread_name_prefix="RepostStorage")
+        self._slots = asyncio.Semaphore(settings.max_queued_operations)
+        self._buffer: WriteBehindBuffer | None = None
+        if settings.write_behind:
+            logger.info(f"Buffering writes for up to {settings.write_behind_flush_interval_ms} ms "
+                        f"or {settings.write_behind_max_rows} rows")
+            self._buffer = WriteBehindBuffer(settings.write_behind_flush_interval_ms,
+                                             settings.write_behind_max_rows,
+                                             partial(self._run, _apply_writes),
+                                             settings.write_behind_max_retries)
+
+    async def insert_and_get_reposts_for_messages(self,
+                                                  group_id: int,
+                                                  reposts: list[NewRepost]) -> list[dict[str, list[int]]]:
+        hashes = set().union(*(repost.hashes for repost in reposts))
+        if len(hashes) == 0:
+            return [dict() for _ in reposts]
+        if self._buffer is None:
+            stored = await self._run(RepostDAO.insert_and_get_reposts_for_messages, group_id, reposts)
+            pending = []
+        else:
+            # take the snapshot before reading so nothing committed by a flush in the meantime can be missed;
+            # anything that ends up in both is de-duplicated
+            pending = self._pending_reposts(group_id) + [_pending_repost(group_id, repost) for repost in reposts]
+            for write in pending[-len(reposts):]:
+                self._buffer.add(write)
+            stored = await self._run(RepostDAO.get_reposts_for_hashes, group_id, hashes)
+        results = []
+        for repost in reposts:
+            result = dict()
+            for entity_hash in repost.hashes:
+                message_ids = _merge_message_ids(stored.get(entity_hash, []),
+                                                 [write.message_id for write in pending if entity_hash in write.hashes])
+                # later messages, whether in the same batch or flushed before this read, can't count against this one
+                result[entity_hash] = message_ids[:message_ids.index(repost.message_id) + 1]
+            results.append(result)
+        return results
+
+    async def insert_reposts_for_messages(self, group_id: int, reposts: list[NewRepost]) -> None:
+        if self._buffer is None:
+            await self._run(RepostDAO.insert_reposts_for_messages, group_id, reposts)
+        else:
+            for repost in reposts:
+                self._buffer.add(_pending_repost(group_id, repost))
+
+    async def get_group_reposts(self, group_id: int) -> dict[str, list[int]]:
+        pending = self._pending_reposts(group_id)
+        stored = await self._run(RepostDAO.get_group_reposts, group_id)
+        for write in pending:
+            for entity_hash in write.hashes:
+                stored[entity_hash] = _merge_message_ids(stored.get(entity_hash, []), [write.message_id])
+        return stored
+
+    async def get_reposts_for_hashes(self, group_id: int, hashes: Iterable[str]) -> dict[str, list[int]]:
+        hashes = set(hashes)
+        pending = self._pending_reposts(group_id)
+        stored = await self._run(RepostDAO.get_reposts_for_hashes, group_id, hashes)
+        for write in pending:
+            for entity_hash in write.hashes.intersection(hashes):
+                stored[entity_hash] = _merge_message_ids(stored.get(entity_hash, []), [write.message_id])
+        return stored
+
+    async def get_group_picture_hashes(self, group_id: int, hash_algorithm: str, include_unrecorded: bool) -> set[str]:
+        pending = self._pending_reposts(group_id)
+        stored = await self._run(RepostDAO.get_group_picture_hashes, group_id, hash_algorithm, include_unrecorded)
+        return stored.union(write.image_hash
+                            for write in pending
+                            if write.image_hash is not None and write.hash_algorithm == hash_algorithm)
+
+    async def scan_all_group_hashes[T](self, consumer: Callable[[Iterator[tuple[int, str]]], T]) -> T:
+        # the consumer runs on a database thread, so it can walk every row without holding up the bot
+        await self.flush()
+        return await self._run(lambda: consumer(RepostDAO.get_all_group_hashes()))
+
+    async def get_whitelisted_hashes(self, group_id: int) -> set[str]:
+        pending = self._pending_writes(group_id, PendingWhitelistInsert, PendingWhitelistClear)
+        whitelisted = await self._run(HashWhitelistDAO.get_whitelisted_hashes_for_group, group_id)
+        # replaying writes that were already committed gives the same result, since a clear always comes first
+        for write in pending:
+            match write:
+                case PendingWhitelistClear():
+                    whitelisted.clear()
+                case PendingWhitelistInsert():
+                    whitelisted.update(write.hashes)
+        return whitelisted
+
+    async def insert_whitelist_hashes(self, group_id: int, hashes: Iterable[str]) -> None:
+        if self._buffer is None:
+            await self._run(HashWhitelistDAO.insert_whitelist_hashes_for_group, group_id, set(hashes))
+        else:
+            self._buffer.add(PendingWhitelistInsert(group_id, frozenset(hashes)))
+
+    async def remove_all_whitelist_hashes(self, group_id: int) -> None:
+        if self._buffer is None:
+            await self._run(HashWhitelistDAO.remove_all_whitelist_hashes_for_group, group_id)
+        else:
+            self._buffer.add(PendingWhitelistClear(group_id))
+
+    async def get_deleted_messages(self, group_id: int, message_ids: Iterable[int]) -> set[int]:
+        message_ids = set(message_ids)
+        pending = self._pending_writes(group_id, PendingDeletedMessages)
+        deleted = await self._run(DeletedMessagesDAO.get_deleted_messages_for_group, group_id, message_ids)
+        return deleted.union(*(write.message_ids.intersection(message_ids) for write in pending))
+
+    async def insert_deleted_messages(self, group_id: int, message_ids: Iterable[int]) -> None:
+        if self._buffer is None:
+            await self._run(DeletedMessagesDAO.insert_deleted_messages_for_group, group_id, set(message_ids))
+        else:
+            self._buffer.add(PendingDeletedMessages(group_id, frozenset(message_ids)))
+
+    async def get_file_hash(self, file_unique_id: str, hash_size: int, hash_algorithm: str) -> str | None:
+        return await self._run(FileHashDAO.get_file_hash, file_unique_id, hash_size, hash_algorithm)
+
+    async def insert_file_hash(self, file_unique_id: str, hash_size: int, hash_algorithm: str, hash_value: str) -> None:
+        await self._run(FileHashDAO.insert_file_hash, file_unique_id, hash_size, hash_algorithm, hash_value)
+
+    async def get_forwarded_hash(self,
+                                 group_id: int,
+                                 origin_chat_id: int,
+                                 origin_message_id: int,
+                                 hash_algorithm: str) -> str | None:
+        return await self._run(ForwardOriginDAO.get_forwarded_hash, group_id, origin_chat_id, origin_message_id,
+                               hash_algorithm)
+
+    async def insert_forwarded_hash(self,
+                                    group_id: int,
+                                    origin_chat_id: int,
+                                    origin_message_id: int,
+                                    hash_algorithm: str,
+                                    hash_value: str) -> None:
+        await self._run(ForwardOriginDAO.insert_forwarded_hash, group_id, origin_chat_id, origin_message_id,
+                        hash_algorithm, hash_value)
+
+    async def get_group_stats(self, group_id: int) -> GroupStats:
+        # the counters are only updated when reposts are committed, so anything buffered has to be first
+        await self.flush()
+        return await self._run(GroupStatsDAO.get_group_stats, group_id)
+
+    async def get_leaderboard(self, group_id: int, since: date | None, limit: int) -> list[UserReposts]:
+        await self.flush()
+        return await self._run(UserStatsDAO.get_leaderboard, group_id, since, limit)
+
+    async def get_user_reposts(self, group_id: int, user_id: int, since: list[date | None]) -> list[int]:
+        await self.flush()
+        return await self._run(UserStatsDAO.get_user_reposts, group_id, user_id, since)
+
+    async def get_retention_group_ids(self) -> list[int]:
+        return await self._run(RetentionDAO.get_group_ids)
+
+    async def remove_reposts_past_retention(self,
+                                            group_id: int,
+                                            before: datetime | None,
+                                            keep_rows: int | None,
+                                            batch_size: int,
+                                            batch_pause_ms: int) -> int:
+        cutoff_id = await self._run(RetentionDAO.get_cutoff_id, group_id, before, keep_rows)
+        if cutoff_id is None:
+            return 0
+        removed = 0
+        # every batch is its own short transaction, and the pause between them lets other writes in
+        while (batch_removed := await self._run(RetentionDAO.remove_reposts_before, group_id, cutoff_id,
+                                                batch_size)) > 0:
+            removed += batch_removed
+            await asyncio.sleep(batch_pause_ms / 1000)
+        return removed
+
+    async def remove_file_hashes_unused_since(self, before: datetime, batch_size: int, batch_pause_ms: int) -> int:
+        removed = 0
+        while (batch_removed := await self._run(FileHashDAO.remove_file_hashes_unused_since, before,
+                                                batch_size)) > 0:
+            removed += batch_removed
+            await asyncio.sleep(batch_pause_ms / 1000)
+        return removed
+
+    async def compact(self, analyze: bool, vacuum_pages: int) -> None:
+        if analyze:
+            await self._run(RetentionDAO.analyze)
+        if vacuum_pages > 0:
+            await self._run(RetentionDAO.incremental_vacuum, vacuum_pages)
+
+    async def get_group_settings(self, group_id: int) -> GroupSettings | None:
+        return await self._run(GroupSettingsDAO.get_group_settings, group_id)
+
+    async def save_group_settings(self, group_id: int, group_settings: GroupSettings) -> None:
+        await self._run(GroupSettingsDAO.save_group_settings, group_id, group_settings)
+
+    async def remove_all_for_group(self, group_id: int) -> None:
+        await self.flush()
+        await self._run(_remove_all_for_group, group_id)
+
+    async def flush(self) -> None:
+        if self._buffer is not None:
+            await self._buffer.flush()
+
+    async def close(self) -> None:
+        await self.flush()
+        logger.info("Waiting for pending database operations")
+        await asyncio.to_thread(self._executor.shutdown, wait=True)
+        close_database()
+
+    def _pending_writes(self, group_id: int, *write_types: type) -> list[PendingWrite]:
+        if self._buffer is None:
+            return []
+        return [write for write in self._buffer.pending_for_group(group_id) if isinstance(write, write_types)]
+
+    def _pending_reposts(self, group_id: int) -> list[PendingRepost]:
+        return self._pending_writes(group_id, PendingRepost)
+
+    async def _run[T](self, fn: Callable[..., T], *args) -> T:
+        # the semaphore bounds how much work can queue up behind the database threads; callers wait here instead
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, *args))
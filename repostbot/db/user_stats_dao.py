@@ -0,0 +1,75 @@
+from dataclasses import dataclass
+from datetime import date
+from sqlite3 import Row
+
+from repostbot.db.connection import get_connection, transaction
+
+
+@dataclass(frozen=True)
+class UserReposts:
+    user_id: int
+    reposts: int
+
+
+class UserStatsDAO:
+
+    @staticmethod
+    def get_leaderboard(group_id: int, since: date | None, limit: int) -> list[UserReposts]:
+        cursor = get_connection().cursor()
+        result: list[Row] = cursor.execute(
+            '''
+             select user_id, sum(reposts) as total from user_reposts
+             where group_id = ? and day >= ?
+             group by user_id
+             order by total desc, user_id
+             limit ?
+             ''',
+            (group_id, since.isoformat() if since is not None else '', limit)
+        ).fetchall()
+        return [UserReposts(int(row['user_id']), int(row['total'])) for row in result]
+
+    @staticmethod
+    def get_user_reposts(group_id: int, user_id: int, since: list[date | None]) -> list[int]:
+        cursor = get_connection().cursor()
+        return [
+            cursor.execute(
+                'select coalesce(sum(reposts), 0) from user_reposts where group_id = ? and user_id = ? and day >= ?',
+                (group_id, user_id, day.isoformat() if day is not None else '')
+            ).fetchone()[0]
+            for day in since
+        ]
+
+    @staticmethod
+    def add_user_reposts(group_id: int, user_id: int, day: date, reposts: int):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                '''
+                 insert into user_reposts(group_id, user_id, day, reposts)
+                 values (?, ?, ?, ?)
+                 on conflict (group_id, user_id, day) do update set reposts = reposts + excluded.reposts
+                 ''',
+                (group_id, user_id, day.isoformat(), reposts)
+            )
+
+    @staticmethod
+    def remove_user_reposts(group_id: int, user_id: int, day: date, reposts: int):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                'update user_reposts set reposts = reposts - ? where group_id = ? and user_id = ? and day = ?',
+                (reposts, group_id, user_id, day.isoformat())
+            )
+            cursor.execute(
+                'delete from user_reposts where group_id = ? and user_id = ? and day = ? and reposts <= 0',
+                (group_id, user_id, day.isoformat())
+            )
+
+    @staticmethod
+    def remove_all_for_group(group_id: int):
+        with transaction() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                'delete from user_reposts where group_id = ?',
+                (group_id,)
+            )
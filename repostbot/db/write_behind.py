@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from repostbot.db.deleted_messages_dao import DeletedMessagesDAO
+from repostbot.db.hash_whitelist_dao import HashWhitelistDAO
+from repostbot.db.repost_dao import RepostDAO
+
+logger = logging.getLogger("WriteBehindBuffer")
+
+
+@dataclass(frozen=True)
+class PendingRepost:
+    group_id: int
+    user_id: int
+    message_id: int
+    hashes: frozenset[str]
+    image_hash: str | None = None
+    hash_algorithm: str | None = None
+    checked_date: datetime = field(default_factory=datetime.now)
+
+    @property
+    def rows(self) -> int:
+        return len(self.hashes)
+
+    def apply(self) -> None:
+        RepostDAO.insert_reposts_for_group(self.group_id, self.user_id, self.message_id, self.hashes, self.checked_date,
+                                           self.image_hash, self.hash_algorithm)
+
+
+@dataclass(frozen=True)
+class PendingDeletedMessages:
+    group_id: int
+    message_ids: frozenset[int]
+
+    @property
+    def rows(self) -> int:
+        return len(self.message_ids)
+
+    def apply(self) -> None:
+        DeletedMessagesDAO.insert_deleted_messages_for_group(self.group_id, self.message_ids)
+
+
+@dataclass(frozen=True)
+class PendingWhitelistInsert:
+    group_id: int
+    hashes: frozenset[str]
+
+    @property
+    def rows(self) -> int:
+        return len(self.hashes)
+
+    def apply(self) -> None:
+        HashWhitelistDAO.insert_whitelist_hashes_for_group(self.group_id, self.hashes)
+
+
+@dataclass(frozen=True)
+class PendingWhitelistClear:
+    group_id: int
+
+    @property
+    def rows(self) -> int:
+        return 1
+
+    def apply(self) -> None:
+        HashWhitelistDAO.remove_all_whitelist_hashes_for_group(self.group_id)
+
+
+type PendingWrite = PendingRepost | PendingDeletedMessages | PendingWhitelistInsert | PendingWhitelistClear
+
+
+class WriteBehindBuffer:
+
+    def __init__(self,
+                 flush_interval_ms: int,
+                 max_rows: int,
+                 write_batch: Callable[[list[PendingWrite]], Awaitable[None]],
+                 max_retries: int = 3):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        self.max_retries = max_retries
+        self._write_batch = write_batch
+        self._failed_flushes = 0
+        self._pending: list[PendingWrite] = []
+        self._in_flight: list[PendingWrite] = []
+        self._pending_rows = 0
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_tasks: set[asyncio.Task] = set()
+
+    def add(self, write: PendingWrite) -> None:
+        self._pending.append(write)
+        self._pending_rows += write.rows
+        if self._pending_rows >= self.max_rows:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+    def pending_for_group(self, group_id: int) -> list[PendingWrite]:
+        # writes being committed right now are included too; they only leave the buffer once the commit is done
+        return [write for write in (*self._in_flight, *self._pending) if write.group_id == group_id]
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            self._cancel_timer()
+            if len(self._pending) == 0:
+                return
+            batch = self._pending
+            self._pending = []
+            self._pending_rows = 0
+            self._in_flight = batch
+            try:
+                await self._write_batch(batch)
+                self._failed_flushes = 0
+                logger.debug(f"Flushed {len(batch)} buffered writes")
+            except Exception as e:
+                self._failed_flushes += 1
+                if self._failed_flushes <= self.max_retries:
+                    logger.error(f"Failed to flush {len(batch)} buffered writes, will retry: {e}")
+                    self._pending = batch + self._pending
+                    self._pending_rows = sum(write.rows for write in self._pending)
+                    self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval,
+                                                                               self._start_flush)
+                else:
+                    # one write that can never be committed would otherwise hold back everything buffered after it
+                    logger.error(f"Failed to flush {len(batch)} buffered writes {self._failed_flushes} times, "
+                                 f"committing them one at a time: {e}")
+                    self._failed_flushes = 0
+                    await self._write_one_at_a_time(batch)
+            finally:
+                self._in_flight = []
+
+    async def _write_one_at_a_time(self, batch: list[PendingWrite]) -> None:
+        for write in batch:
+            try:
+                await self._write_batch([write])
+            except Exception as e:
+                logger.error(f"Dropping buffered write that can't be committed: {write}: {e}")
+
+    def _start_flush(self) -> None:
+        self._cancel_timer()
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    def _cancel_timer(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
@@ -0,0 +1,40 @@
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger("FileHashCache")
+
+
+class FileHashCache:
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._hashes: OrderedDict[tuple[str, int, str], str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # hash_algorithm is ImageHasher.cache_algorithm's name for it, the same one the file_hashes table is keyed by
+    def get(self, file_unique_id: str, hash_size: int, hash_algorithm: str) -> str | None:
+        key = (file_unique_id, hash_size, hash_algorithm)
+        image_hash = self._hashes.get(key)
+        if image_hash is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._hashes.move_to_end(key)
+        return image_hash
+
+    def put(self, file_unique_id: str, hash_size: int, hash_algorithm: str, image_hash: str) -> None:
+        if self.max_entries <= 0:
+            return
+        key = (file_unique_id, hash_size, hash_algorithm)
+        self._hashes[key] = image_hash
+        self._hashes.move_to_end(key)
+        while len(self._hashes) > self.max_entries:
+            self._hashes.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._hashes),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import copy
 from enum import Enum
 from typing import Any
 
@@ -8,6 +9,10 @@ from .toggles import Toggles, ToggleType
 
 class GroupDataKeys(Enum):
     TOGGLES = "toggles"
+    IMAGE_MATCH_THRESHOLD = "image_match_threshold"
+    HASH_ALGORITHM = "hash_algorithm"
+    RETENTION_DAYS = "retention_days"
+    RETENTION_MAX_ROWS = "retention_max_rows"
 
 
 class GroupSettings:
@@ -29,7 +34,37 @@ class GroupSettings:
     def toggles(self, value: Toggles):
         self._dict[GroupDataKeys.TOGGLES.value] = value
 
-    def to_dict(self) -> dict[str, Any]:
-        return {
-            GroupDataKeys.TOGGLES.value: self.toggles.as_dict(),
-        }
+    @property
+    def image_match_threshold(self) -> int | None:
+        return self._dict.get(GroupDataKeys.IMAGE_MATCH_THRESHOLD.value)
+
+    @image_match_threshold.setter
+    def image_match_threshold(self, value: int):
+        self._dict[GroupDataKeys.IMAGE_MATCH_THRESHOLD.value] = value
+
+    @property
+    def hash_algorithm(self) -> str | None:
+        return self._dict.get(GroupDataKeys.HASH_ALGORITHM.value)
+
+    @hash_algorithm.setter
+    def hash_algorithm(self, value: str):
+        self._dict[GroupDataKeys.HASH_ALGORITHM.value] = value
+
+    @property
+    def retention_days(self) -> int | None:
+        return self._dict.get(GroupDataKeys.RETENTION_DAYS.value)
+
+    @retention_days.setter
+    def retention_days(self, value: int):
+        self._dict[GroupDataKeys.RETENTION_DAYS.value] = value
+
+    @property
+    def retention_max_rows(self) -> int | None:
+        return self._dict.get(GroupDataKeys.RETENTION_MAX_ROWS.value)
+
+    @retention_max_rows.setter
+    def retention_max_rows(self, value: int):
+        self._dict[GroupDataKeys.RETENTION_MAX_ROWS.value] = value
+
+    def copy(self) -> GroupSettings:
+        return GroupSettings(copy.deepcopy(self._dict))
@@ -0,0 +1,124 @@
+import logging
+import math
+from abc import ABC, abstractmethod
+from functools import cache
+from typing import Iterable
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger("HashAlgorithms")
+
+
+def bits_to_ints(bits: np.ndarray) -> list[int]:
+    # rows of booleans, most significant bit first, the same order imagehash uses for its hex strings
+    rows = bits.reshape(len(bits), -1)
+    packed = np.packbits(rows, axis=1)
+    padding = packed.shape[1] * 8 - rows.shape[1]
+    return [int.from_bytes(row.tobytes(), 'big') >> padding for row in packed]
+
+
+def hash_to_hex(image_hash: int, hash_size: int) -> str:
+    # padded to whole bytes so it can be stored as the bytes it spells out
+    return format(image_hash, f'0{math.ceil(hash_size ** 2 / 8) * 2}x')
+
+
+class HashAlgorithm(ABC):
+
+    @staticmethod
+    @abstractmethod
+    def resize_dimensions(hash_size: int) -> tuple[int, int]:
+        pass
+
+    @staticmethod
+    @abstractmethod
+    def hash_pixels(pixels: np.ndarray, hash_size: int) -> np.ndarray:
+        # (images, height, width) greyscale pixels in, (images, hash_size, hash_size) bits out
+        pass
+
+    @classmethod
+    def hash_images(cls, images: Iterable[Image.Image], hash_size: int) -> list[int]:
+        if hash_size < 2:
+            raise ValueError('Hash size must be greater than or equal to 2')
+        dimensions = cls.resize_dimensions(hash_size)
+        pixels = np.stack([
+            np.asarray(image.convert('L').resize(dimensions, Image.Resampling.LANCZOS))
+            for image in images
+        ])
+        return bits_to_ints(cls.hash_pixels(pixels, hash_size))
+
+
+class _AverageHash(HashAlgorithm):
+
+    @staticmethod
+    def resize_dimensions(hash_size: int) -> tuple[int, int]:
+        return hash_size, hash_size
+
+    @staticmethod
+    def hash_pixels(pixels: np.ndarray, hash_size: int) -> np.ndarray:
+        return pixels > pixels.mean(axis=(1, 2), keepdims=True)
+
+
+class _DifferenceHash(HashAlgorithm):
+
+    @staticmethod
+    def resize_dimensions(hash_size: int) -> tuple[int, int]:
+        return hash_size + 1, hash_size
+
+    @staticmethod
+    def hash_pixels(pixels: np.ndarray, hash_size: int) -> np.ndarray:
+        return pixels[:, :, 1:] > pixels[:, :, :-1]
+
+
+class _PerceptualHash(HashAlgorithm):
+    _HIGH_FREQUENCY_FACTOR = 4
+
+    @staticmethod
+    def resize_dimensions(hash_size: int) -> tuple[int, int]:
+        image_size = hash_size * _PerceptualHash._HIGH_FREQUENCY_FACTOR
+        return image_size, image_size
+
+    @staticmethod
+    def hash_pixels(pixels: np.ndarray, hash_size: int) -> np.ndarray:
+        # only the lowest frequencies are kept, so the dct is just those rows of the dct-ii matrix on both sides
+        dct = _dct_matrix(hash_size, pixels.shape[1])
+        low_frequencies = dct @ pixels.astype(np.float64) @ dct.T
+        medians = np.median(low_frequencies.reshape(len(pixels), -1), axis=1)
+        return low_frequencies > medians[:, np.newaxis, np.newaxis]
+
+
+@cache
+def _dct_matrix(frequencies: int, size: int) -> np.ndarray:
+    k = np.arange(frequencies)[:, np.newaxis]
+    n = np.arange(size)[np.newaxis, :]
+    return 2 * np.cos(np.pi * k * (2 * n + 1) / (2 * size))
+
+
+_HASH_ALGORITHMS: dict[str, type[HashAlgorithm]] = {
+    "ahash": _AverageHash,
+    "dhash": _DifferenceHash,
+    "phash": _PerceptualHash,
+}
+DEFAULT_HASH_ALGORITHM = "ahash"
+# pictures stored before the algorithm was recorded with them were hashed with imagehash's average_hash
+UNRECORDED_HASH_ALGORITHM = "ahash"
+
+
+def get_hash_algorithm_name(algorithm: str) -> str:
+    name = algorithm.lower().strip()
+    if name not in _HASH_ALGORITHMS:
+        logger.error(f"Cannot find hash algorithm {algorithm}, using default {DEFAULT_HASH_ALGORITHM}")
+        return DEFAULT_HASH_ALGORITHM
+    return name
+
+
+def get_hash_algorithm(algorithm: str) -> type[HashAlgorithm]:
+    return _HASH_ALGORITHMS[get_hash_algorithm_name(algorithm)]
+
+
+def is_hash_algorithm(algorithm: str) -> bool:
+    return algorithm.lower().strip() in _HASH_ALGORITHMS
+
+
+def get_all_hash_algorithms() -> list[str]:
+    return list(_HASH_ALGORITHMS.keys())
@@ -0,0 +1,88 @@
+import logging
+import sys
+from collections import OrderedDict
+
+logger = logging.getLogger("GroupHashIndex")
+
+# rough per-item costs for a dict[str, list[int]]: the dict slot and list for each hash, and the list slot and int
+# object for each message id
+_BYTES_PER_HASH = 64 + 56
+_BYTES_PER_MESSAGE_ID = 8 + 32
+
+
+def _estimate_size(reposts: dict[str, list[int]]) -> int:
+    return sum(
+        sys.getsizeof(entity_hash) + _BYTES_PER_HASH + _BYTES_PER_MESSAGE_ID * len(message_ids)
+        for entity_hash, message_ids in reposts.items()
+    )
+
+
+class GroupHashIndex:
+
+    def __init__(self, max_memory_mb: float):
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self._groups: OrderedDict[int, dict[str, list[int]]] = OrderedDict()
+        self._group_sizes: dict[int, int] = dict()
+        self._total_bytes = 0
+        self._oversized_groups: set[int] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def can_hold(self, group_id: int) -> bool:
+        return self.enabled and group_id not in self._oversized_groups
+
+    def get(self, group_id: int) -> dict[str, list[int]] | None:
+        reposts = self._groups.get(group_id)
+        if reposts is not None:
+            self._groups.move_to_end(group_id)
+        return reposts
+
+    def put(self, group_id: int, reposts: dict[str, list[int]]) -> bool:
+        self.discard(group_id)
+        size = _estimate_size(reposts)
+        if size > self.max_bytes:
+            logger.info(f"Group {group_id} is too large to keep in memory ({size} bytes)")
+            self._oversized_groups.add(group_id)
+            return False
+        self._groups[group_id] = reposts
+        self._group_sizes[group_id] = size
+        self._total_bytes += size
+        self._evict(keep=group_id)
+        return True
+
+    def add(self, group_id: int, message_id: int, hashes: set[str]) -> dict[str, list[int]]:
+        reposts = self._groups[group_id]
+        added_bytes = 0
+        for entity_hash in hashes:
+            message_ids = reposts.get(entity_hash)
+            if message_ids is None:
+                message_ids = reposts[entity_hash] = []
+                added_bytes += sys.getsizeof(entity_hash) + _BYTES_PER_HASH
+            if message_id not in message_ids:
+                message_ids.append(message_id)
+                added_bytes += _BYTES_PER_MESSAGE_ID
+        self._group_sizes[group_id] += added_bytes
+        self._total_bytes += added_bytes
+        self._groups.move_to_end(group_id)
+        if self._group_sizes[group_id] > self.max_bytes:
+            self.discard(group_id)
+            self._oversized_groups.add(group_id)
+        else:
+            self._evict(keep=group_id)
+        return {entity_hash: list(reposts[entity_hash]) for entity_hash in hashes}
+
+    def discard(self, group_id: int) -> None:
+        self._oversized_groups.discard(group_id)
+        if self._groups.pop(group_id, None) is not None:
+            self._total_bytes -= self._group_sizes.pop(group_id)
+
+    def _evict(self, keep: int) -> None:
+        while self._total_bytes > self.max_bytes:
+            group_id = next(iter(self._groups))
+            if group_id == keep:
+                break
+            logger.debug(f"Evicting group {group_id} from memory")
+            self._groups.pop(group_id)
+            self._total_bytes -= self._group_sizes.pop(group_id)
@@ -0,0 +1,124 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Iterator
+
+from PIL import Image
+from telegram import File
+
+from repostbot.hash_algorithms import HashAlgorithm, get_hash_algorithm, hash_to_hex
+
+logger = logging.getLogger("ImageHashing")
+
+
+def hash_images(sources: list[str | bytes], hash_size: int, algorithm: str, draft_decode: bool = False) -> list[str]:
+    # file paths or encoded image bytes in, hex hashes out, with every picture hashed by one call to the algorithm
+    hash_algorithm = get_hash_algorithm(algorithm)
+    image_hashes = hash_algorithm.hash_images(_open_images(sources, hash_size, hash_algorithm, draft_decode), hash_size)
+    return [hash_to_hex(image_hash, hash_size) for image_hash in image_hashes]
+
+
+def _open_images(sources: list[str | bytes],
+                 hash_size: int,
+                 hash_algorithm: type[HashAlgorithm],
+                 draft_decode: bool) -> Iterator[Image.Image]:
+    # opened one at a time; each is resized before the next is decoded, so only one full size picture is in memory
+    for source in sources:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+            if draft_decode:
+                # jpegs can be decoded at 1/2, 1/4 or 1/8 scale; draft picks the smallest that's still at least as
+                # big as the algorithm resizes to, and it does nothing for other formats
+                image.draft('L', hash_algorithm.resize_dimensions(hash_size))
+            yield image
+
+
+_EXECUTORS: dict[str, type[Executor]] = {
+    "process": ProcessPoolExecutor,
+    "thread": ThreadPoolExecutor,
+}
+
+
+class ImageHasher:
+
+    def __init__(self,
+                 hash_size: int,
+                 executor: str,
+                 max_workers: int,
+                 max_queued: int,
+                 max_in_memory_kb: int,
+                 draft_decode: bool):
+        self.hash_size = hash_size
+        self.draft_decode = draft_decode
+        self.max_in_memory_bytes = max_in_memory_kb * 1024
+        max_workers = max_workers if max_workers > 0 else (os.cpu_count() or 1)
+        executor_type = _EXECUTORS.get(executor.lower().strip())
+        if executor_type is None:
+            logger.error(f"Unknown image hashing executor {executor}, using process")
+            executor_type = ProcessPoolExecutor
+        logger.info(f"Hashing images with {max_workers} worker(s) using {executor_type.__name__}"
+                    f"{' and reduced-resolution jpeg decoding' if draft_decode else ''}")
+        if executor_type is ProcessPoolExecutor:
+            # forking would copy the bot's threads and event loop into the workers; forkserver isn't on windows
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = executor_type(max_workers=max_workers,
+                                           mp_context=multiprocessing.get_context(start_method))
+        else:
+            self._executor = executor_type(max_workers=max_workers)
+        # images being downloaded or hashed plus ones waiting for a worker; anything past that waits before
+        # it's downloaded so a flood of photos can't pile up in memory
+        self._max_slots = max_workers + max_queued
+        self._slots = asyncio.Semaphore(self._max_slots)
+        self._reserve_lock = asyncio.Lock()
+
+    def cache_algorithm(self, algorithm: str) -> str:
+        # what cached hashes are stored under. draft decoding moves hashes a few bits, so hashes made with it on
+        # aren't reused once it's off, or the other way round
+        return f'{algorithm}+draft' if self.draft_decode else algorithm
+
+    async def hash_telegram_files(self, files: list[File], algorithm: str) -> list[str]:
+        # the pictures in an album are downloaded together and hashed in one batch by one worker
+        async with self._reserve_slots(len(files)):
+            temp_paths = []
+            try:
+                sources = await asyncio.gather(*(self._download(file, temp_paths) for file in files))
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._executor,
+                    partial(hash_images, sources, self.hash_size, algorithm, self.draft_decode)
+                )
+            finally:
+                for path in temp_paths:
+                    os.remove(path)
+
+    async def close(self) -> None:
+        await asyncio.to_thread(self._executor.shutdown, wait=True)
+
+    @asynccontextmanager
+    async def _reserve_slots(self, count: int) -> AsyncIterator[None]:
+        # a batch takes all of its slots before anything else can take one, so two albums can't each hold half
+        # of the slots and wait on each other forever
+        count = min(count, self._max_slots)
+        reserved = 0
+        try:
+            async with self._reserve_lock:
+                while reserved < count:
+                    await self._slots.acquire()
+                    reserved += 1
+            yield
+        finally:
+            for _ in range(reserved):
+                self._slots.release()
+
+    async def _download(self, file: File, temp_paths: list[str]) -> str | bytes:
+        if file.file_size is None or file.file_size <= self.max_in_memory_bytes:
+            return bytes(await file.download_as_bytearray())
+        logger.info(f"File is {file.file_size} bytes; downloading to a temporary file")
+        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
+            temp_paths.append(temp_file.name)
+        await file.download_to_drive(temp_file.name)
+        return temp_file.name
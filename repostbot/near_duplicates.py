@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import logging
+import math
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Iterable
+
+import numpy as np
+
+logger = logging.getLogger("NearDuplicates")
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return (first ^ second).bit_count()
+
+
+class NearDuplicateSearch(ABC):
+
+    @abstractmethod
+    def add(self, image_hash: str) -> None:
+        pass
+
+    @abstractmethod
+    def search(self, image_hash: str, threshold: int) -> set[str]:
+        pass
+
+
+class BKTree(NearDuplicateSearch):
+
+    def __init__(self, image_hashes: Iterable[str] = ()):
+        # each node is (hash as int, hash as hex, children keyed by distance to this node)
+        self._root: tuple[int, str, dict[int, tuple]] | None = None
+        self._size = 0
+        for image_hash in image_hashes:
+            self.add(image_hash)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, image_hash: str) -> None:
+        value = int(image_hash, 16)
+        if self._root is None:
+            self._root = (value, image_hash, dict())
+            self._size += 1
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, image_hash, dict())
+                self._size += 1
+                return
+            node = child
+
+    def search(self, image_hash: str, threshold: int) -> set[str]:
+        if self._root is None:
+            return set()
+        value = int(image_hash, 16)
+        matches = set()
+        nodes = [self._root]
+        while len(nodes) > 0:
+            node_value, node_hash, children = nodes.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= threshold:
+                matches.add(node_hash)
+            # triangle inequality: only subtrees whose edge is within threshold of the distance can hold a match
+            nodes.extend(
+                child
+                for child_distance, child in children.items()
+                if distance - threshold <= child_distance <= distance + threshold
+            )
+        return matches
+
+
+class PackedHashScan(NearDuplicateSearch):
+    _INITIAL_CAPACITY = 1024
+    _POPCOUNTS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+    def __init__(self, image_hashes: Iterable[str] = ()):
+        self._hashes: list[str] = []
+        self._known_hashes: set[str] = set()
+        self._words: int | None = None
+        self._packed: np.ndarray | None = None
+        for image_hash in image_hashes:
+            self.add(image_hash)
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, image_hash: str) -> None:
+        if image_hash in self._known_hashes:
+            return
+        if self._words is None:
+            self._words = max(1, math.ceil(len(image_hash) * 4 / 64))
+            # one row per word, so each pass of the scan runs over contiguous memory
+            self._packed = np.zeros((self._words, self._INITIAL_CAPACITY), dtype=np.uint64)
+        packed = self._pack(image_hash)
+        if packed is None:
+            return
+        count = len(self._hashes)
+        if count == self._packed.shape[1]:
+            self._packed = np.concatenate([self._packed, np.zeros_like(self._packed)], axis=1)
+        self._packed[:, count] = packed
+        self._hashes.append(image_hash)
+        self._known_hashes.add(image_hash)
+
+    def search(self, image_hash: str, threshold: int) -> set[str]:
+        count = len(self._hashes)
+        packed = self._pack(image_hash) if count > 0 else None
+        if packed is None:
+            return set()
+        # one XOR and popcount over every stored hash at once
+        xor = np.bitwise_xor(self._packed[:, :count], packed[:, np.newaxis])
+        distances = self._popcount(xor).sum(axis=0, dtype=np.uint32)
+        return {self._hashes[index] for index in np.flatnonzero(distances <= threshold)}
+
+    def _pack(self, image_hash: str) -> np.ndarray | None:
+        value = int(image_hash, 16)
+        if value.bit_length() > self._words * 64:
+            logger.debug(f"Skipping hash that doesn't fit in {self._words} words")
+            return None
+        return np.frombuffer(value.to_bytes(self._words * 8, 'big'), dtype='>u8').astype(np.uint64)
+
+    @classmethod
+    def _popcount(cls, words: np.ndarray) -> np.ndarray:
+        if hasattr(np, 'bitwise_count'):
+            return np.bitwise_count(words)
+        return cls._POPCOUNTS[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1)
+
+
+_NEAR_DUPLICATE_SEARCHES: dict[str, type[NearDuplicateSearch]] = {
+    "bktree": BKTree,
+    "scan": PackedHashScan,
+}
+DEFAULT_NEAR_DUPLICATE_SEARCH = "bktree"
+
+
+def get_near_duplicate_search(search: str) -> type[NearDuplicateSearch]:
+    try:
+        return _NEAR_DUPLICATE_SEARCHES[search.lower().strip()]
+    except KeyError:
+        logger.error(f"Cannot find near-duplicate search for {search}, using default {DEFAULT_NEAR_DUPLICATE_SEARCH}")
+    return _NEAR_DUPLICATE_SEARCHES[DEFAULT_NEAR_DUPLICATE_SEARCH]
+
+
+class NearDuplicateIndex:
+
+    def __init__(self, max_groups: int, search_type: type[NearDuplicateSearch]):
+        self.max_groups = max_groups
+        self.search_type = search_type
+        # hashes from different algorithms can't be compared, so each algorithm a group has used gets its own search
+        self._groups: OrderedDict[tuple[int, str], NearDuplicateSearch] = OrderedDict()
+
+    def get(self, group_id: int, hash_algorithm: str) -> NearDuplicateSearch | None:
+        search = self._groups.get((group_id, hash_algorithm))
+        if search is not None:
+            self._groups.move_to_end((group_id, hash_algorithm))
+        return search
+
+    def put(self, group_id: int, hash_algorithm: str, image_hashes: Iterable[str]) -> NearDuplicateSearch:
+        search = self.search_type(image_hashes)
+        self._groups[(group_id, hash_algorithm)] = search
+        self._groups.move_to_end((group_id, hash_algorithm))
+        while len(self._groups) > max(1, self.max_groups):
+            (evicted_group_id, evicted_algorithm), _ = self._groups.popitem(last=False)
+            logger.debug(f"Evicting {evicted_algorithm} near-duplicate index for group {evicted_group_id}")
+        return search
+
+    def add(self, group_id: int, hash_algorithm: str, image_hash: str) -> None:
+        search = self._groups.get((group_id, hash_algorithm))
+        if search is not None:
+            search.add(image_hash)
+
+    def discard(self, group_id: int) -> None:
+        for key in [key for key in self._groups if key[0] == group_id]:
+            del self._groups[key]
@@ -0,0 +1,30 @@
+from dataclasses import dataclass
+from typing import Sequence
+
+from telegram import PhotoSize
+
+
+@dataclass(frozen=True)
+class PhotoSizePolicy:
+    min_dimension: int
+    compatibility_threshold: int
+
+    @property
+    def uses_largest(self) -> bool:
+        return self.min_dimension <= 0
+
+    def select(self, photo_sizes: Sequence[PhotoSize]) -> PhotoSize:
+        # telegram sends renditions smallest first; average_hash shrinks whatever it gets down to hash_size anyway
+        if self.uses_largest:
+            return photo_sizes[-1]
+        for photo_size in photo_sizes:
+            if min(photo_size.width, photo_size.height) >= self.min_dimension:
+                return photo_size
+        return photo_sizes[-1]
+
+    def image_match_threshold(self, group_threshold: int) -> int:
+        # hashes stored before a smaller rendition was picked came from the largest one, so they're a few bits off.
+        # it's opt-in since it overrides every group's own threshold, including turning matching on where it's off
+        if self.uses_largest or self.compatibility_threshold <= 0:
+            return group_threshold
+        return max(group_threshold, self.compatibility_threshold)
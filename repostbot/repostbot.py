@@ -1,4 +1,7 @@
+import asyncio
 import logging
+from dataclasses import dataclass
+from datetime import timedelta
 
 import telegram.ext.filters as filters
 from telegram import Chat, Bot
@@ -6,16 +9,20 @@ from telegram import KeyboardButton
 from telegram import ReplyKeyboardMarkup
 from telegram import ReplyKeyboardRemove
 from telegram import Update
+from telegram.constants import BulkRequestLimit
 from telegram.error import Forbidden, BadRequest
 from telegram.ext import CallbackContext, Application
 from telegram.ext import CommandHandler
 from telegram.ext import ConversationHandler
 from telegram.ext import MessageHandler
 
-from utils import flood_protection, sum_list_lengths, message_from_anonymous_admin, RepostBotTelegramParams, \
+from utils import flood_protection, message_from_anonymous_admin, RepostBotTelegramParams, \
     strip_nonalpha_chars, get_repost_params, flatten_repost_lists_except_original
+from .album_buffer import AlbumBuffer
 from .conversation_state import ConversationState
+from .hash_algorithms import get_all_hash_algorithms, is_hash_algorithm
 from .repostitory import Repostitory
+from .stats_window import StatsWindow
 from .strategies import RepostCalloutStrategy
 from .toggles import Toggles
 from .whitelist_status import WhitelistAddStatus
@@ -28,13 +35,18 @@ CHECK_FOR_REPOST_FILTERS = NON_PRIVATE_GROUP_FILTER & \
                            (filters.PHOTO | filters.Entity("url")) & \
                            ~(filters.FORWARDED & ~filters.SenderChat.CHANNEL)
 
-URL_KEY_LENGTH = 64
-
 
 async def _userid_reply(update: Update, context: CallbackContext) -> None:
     await update.effective_message.reply_text(str(update.effective_user.id))
 
 
+@dataclass(frozen=True)
+class _AlbumMessage:
+    update: Update
+    context: CallbackContext
+    params: RepostBotTelegramParams
+
+
 class RepostBot:
 
     def __init__(
@@ -48,6 +60,9 @@ class RepostBot:
             group_whitelist: list[int],
             group_blacklist: list[int],
             drop_pending_updates: bool,
+            album_window_ms: int,
+            leaderboard_size: int,
+            stats_windows: list[StatsWindow],
     ):
         self.token = token
         self.admin_id = admin_id
@@ -58,13 +73,22 @@ class RepostBot:
         self.group_whitelist = group_whitelist
         self.group_blacklist = group_blacklist
         self.drop_pending_updates = drop_pending_updates
+        self.leaderboard_size = leaderboard_size
+        self.stats_windows = stats_windows
+        self._startup_task: asyncio.Task | None = None
+        self.album_buffer: AlbumBuffer[_AlbumMessage] = AlbumBuffer(album_window_ms, self._check_potential_album)
 
         self.config_group_filter = (filters.Chat(chat_id=group_whitelist, allow_empty=True) &
                                     ~filters.Chat(chat_id=group_blacklist))
 
         self.default_group_filter = self.config_group_filter & NON_PRIVATE_GROUP_FILTER
 
-        self.application: Application = Application.builder().token(token).build()
+        self.application: Application = (Application.builder()
+                                                 .token(token)
+                                                 .post_init(self._on_startup)
+                                                 .post_stop(self._on_stop)
+                                                 .post_shutdown(self._on_shutdown)
+                                                 .build())
 
         self.application.add_handlers([
             MessageHandler(callback=self._check_potential_repost,
@@ -95,6 +119,18 @@ class RepostBot:
                            callback=self._display_toggle_settings,
                            filters=self.default_group_filter),
 
+            CommandHandler(command="threshold",
+                           callback=self._set_image_match_threshold,
+                           filters=self.default_group_filter),
+
+            CommandHandler(command="algorithm",
+                           callback=self._set_hash_algorithm,
+                           filters=self.default_group_filter),
+
+            CommandHandler(command="retention",
+                           callback=self._set_retention,
+                           filters=self.default_group_filter),
+
             CommandHandler(command="whitelist",
                            callback=self._whitelist_command,
                            filters=self.default_group_filter),
@@ -103,6 +139,14 @@ class RepostBot:
                            callback=self._stats_command,
                            filters=self.default_group_filter),
 
+            CommandHandler(command="leaderboard",
+                           callback=self._leaderboard_command,
+                           filters=self.default_group_filter),
+
+            CommandHandler(command="mystats",
+                           callback=self._my_stats_command,
+                           filters=self.default_group_filter),
+
             CommandHandler(command="userid",
                            callback=_userid_reply,
                            filters=self.config_group_filter & ~NON_PRIVATE_GROUP_FILTER),
@@ -112,19 +156,68 @@ class RepostBot:
         logger.info("Bot is running")
         self.application.run_polling(drop_pending_updates=self.drop_pending_updates)
 
+    async def _on_startup(self, application: Application) -> None:
+        # don't hold up polling while the bloom filters are built; lookups fall back to the database until then
+        self._startup_task = asyncio.create_task(self.repostitory.start())
+        retention_settings = self.repostitory.retention_settings
+        if not retention_settings.enabled:
+            return
+        if application.job_queue is None:
+            logger.warning("Retention is turned on, but the job-queue extra of python-telegram-bot isn't installed")
+            return
+        interval = timedelta(minutes=retention_settings.interval_minutes)
+        application.job_queue.run_repeating(self._apply_retention, interval=interval, first=interval,
+                                            name="retention")
+
+    async def _apply_retention(self, context: CallbackContext) -> None:
+        await self.repostitory.apply_retention()
+
+    async def _on_stop(self, application: Application) -> None:
+        # the bot can still send messages here, so albums still waiting are called out instead of dropped
+        await self.album_buffer.close()
+
+    async def _on_shutdown(self, application: Application) -> None:
+        logger.info("Shutting down")
+        if self._startup_task is not None and not self._startup_task.done():
+            self._startup_task.cancel()
+        await self.repostitory.close()
+
     @get_repost_params
     async def _check_potential_repost(self,
                                       update: Update,
                                       context: CallbackContext,
                                       params: RepostBotTelegramParams = None):
+        message = params.effective_message
+        if self.album_buffer.enabled and message.media_group_id is not None:
+            self.album_buffer.add((params.group_id, message.media_group_id), _AlbumMessage(update, context, params))
+            return
         hash_to_message_ids_map = await self.repostitory.process_message_entities(params)
+        await self._handle_reposts(update, context, params, hash_to_message_ids_map)
+
+    async def _check_potential_album(self, album: list[_AlbumMessage]) -> None:
+        album_results = await self.repostitory.process_album_entities([message.params for message in album])
+        hash_to_message_ids_map = dict()
+        for result in album_results:
+            for entity_hash, message_ids in result.items():
+                hash_to_message_ids_map[entity_hash] = sorted({*hash_to_message_ids_map.get(entity_hash, []),
+                                                               *message_ids})
+        # the whole album gets one callout, as a reply to its first message
+        first_message = album[0]
+        await self._handle_reposts(first_message.update, first_message.context, first_message.params,
+                                   hash_to_message_ids_map)
+
+    async def _handle_reposts(self,
+                              update: Update,
+                              context: CallbackContext,
+                              params: RepostBotTelegramParams,
+                              hash_to_message_ids_map: dict[str, list[int]]) -> None:
         hashes_with_reposts = {
             entity_hash: message_ids
             for entity_hash, message_ids in hash_to_message_ids_map.items()
             if len(message_ids) > 1
         }
         if any(len(messages) > 0 for messages in hashes_with_reposts.values()):
-            toggles = self.repostitory.get_toggles_data(params.group_id)
+            toggles = await self.repostitory.get_toggles_data(params.group_id)
             if toggles.auto_callout:
                 await self._call_out_reposts(update, context, params, hashes_with_reposts)
             if toggles.auto_delete:
@@ -139,17 +232,33 @@ class RepostBot:
         await self.repost_callout_strategy.callout(context, hash_to_message_id_dict, params)
 
     async def _delete_reposts(self, group_id: int, hashes_with_reposts: dict[str, list[int]], bot: Bot) -> None:
-        deleted_messages: set[int] = self.repostitory.get_deleted_messages(group_id)
         flattened_messages: set[int] = set(flatten_repost_lists_except_original(list(hashes_with_reposts.values())))
+        deleted_messages: set[int] = await self.repostitory.get_deleted_messages(group_id, flattened_messages)
+        messages_to_delete = sorted(flattened_messages.difference(deleted_messages))
         newly_deleted_messages = set()
-        for message_id in flattened_messages.difference(deleted_messages):
+        for start in range(0, len(messages_to_delete), BulkRequestLimit.MAX_LIMIT):
+            chunk = messages_to_delete[start:start + BulkRequestLimit.MAX_LIMIT]
+            try:
+                await bot.delete_messages(group_id, chunk)
+            except (Forbidden, BadRequest) as e:
+                # the whole request fails if any one message can't be deleted, so find out which one it was
+                logger.info(f"Deleting {len(chunk)} messages at once failed, deleting them one by one: {e.message}")
+                newly_deleted_messages.update(await self._delete_messages_individually(group_id, chunk, bot))
+            else:
+                newly_deleted_messages.update(chunk)
+        await self.repostitory.updated_deleted_messages(group_id, newly_deleted_messages)
+
+    @staticmethod
+    async def _delete_messages_individually(group_id: int, message_ids: list[int], bot: Bot) -> set[int]:
+        deleted_messages = set()
+        for message_id in message_ids:
             try:
                 await bot.delete_message(group_id, message_id)
             except (Forbidden, BadRequest) as e:
                 logger.error(e.message)
             else:
-                newly_deleted_messages.add(message_id)
-        self.repostitory.updated_deleted_messages(group_id, newly_deleted_messages)
+                deleted_messages.add(message_id)
+        return deleted_messages
 
     @get_repost_params
     @flood_protection("toggle")
@@ -163,14 +272,14 @@ class RepostBot:
             return
         group_id = message.chat.id
         responses = list()
-        toggle_data = self.repostitory.get_toggles_data(group_id)
+        toggle_data = await self.repostitory.get_toggles_data(group_id)
         for toggle_type, arg in Toggles.get_toggle_args():
             if arg in context.args:
                 toggle_data[toggle_type] = not toggle_data[toggle_type]
                 toggle_name = Toggles.get_toggle_display_name(toggle_type, self.strings)
                 display_value = self.strings["enabled"] if toggle_data[toggle_type] else self.strings["disabled"]
                 responses.append(f"{toggle_name}: {display_value}")
-        self.repostitory.save_toggles_data(group_id, toggle_data)
+        await self.repostitory.save_toggles_data(group_id, toggle_data)
         await message.reply_text("\n".join(responses))
 
     @get_repost_params
@@ -182,10 +291,7 @@ class RepostBot:
         user_id = params.sender_id
         message = params.effective_message
         chat = message.chat
-        if (user_id == self.admin_id
-                or user_id in (chat_member.user.id for chat_member in await chat.get_administrators())
-                or message_from_anonymous_admin(user_id)
-        ):
+        if await self._is_admin(user_id, chat):
             keyboard_buttons = [
                 [KeyboardButton(self.strings["group_reset_yes"]), KeyboardButton(self.strings["group_reset_no"])]
             ]
@@ -198,6 +304,11 @@ class RepostBot:
             await message.reply_text(self.strings["group_repost_reset_admin_only"])
             return ConversationHandler.END
 
+    async def _is_admin(self, user_id: int, chat: Chat) -> bool:
+        return (user_id == self.admin_id
+                or user_id in (chat_member.user.id for chat_member in await chat.get_administrators())
+                or message_from_anonymous_admin(user_id))
+
     @get_repost_params
     async def _handle_reset_confirmation(self,
                                          update: Update,
@@ -206,7 +317,7 @@ class RepostBot:
         response = strip_nonalpha_chars(str(params.effective_message.text))
         bot_response = self.strings["group_repost_reset_cancel"]
         if response in self.strings["group_reset_confirmation_responses"]:
-            self.repostitory.reset_group_repost_data(params.group_id)
+            await self.repostitory.reset_group_repost_data(params.group_id)
             bot_response = self.strings["group_repost_data_reset"]
         await params.effective_message.reply_text(bot_response, reply_markup=ReplyKeyboardRemove(), quote=True)
         return ConversationHandler.END
@@ -239,7 +350,7 @@ class RepostBot:
                                        update: Update,
                                        context: CallbackContext,
                                        params: RepostBotTelegramParams = None) -> None:
-        group_toggles = self.repostitory.get_toggles_data(params.group_id)
+        group_toggles = await self.repostitory.get_toggles_data(params.group_id)
         responses = [self.strings['settings_command_response']]
         for toggle_type, _ in group_toggles.get_toggle_args():
             display_name = Toggles.get_toggle_display_name(toggle_type, self.strings)
@@ -247,8 +358,76 @@ class RepostBot:
             responses.append(
                 f"{display_name}: {display_value}"
             )
+        image_match_threshold = await self.repostitory.get_image_match_threshold(params.group_id)
+        responses.append(f"{self.strings['settings_image_match_threshold']}: {image_match_threshold}")
+        hash_algorithm = await self.repostitory.get_hash_algorithm(params.group_id)
+        responses.append(f"{self.strings['settings_hash_algorithm']}: {hash_algorithm}")
+        max_age_days, max_rows = await self.repostitory.get_retention(params.group_id)
+        responses.append(f"{self.strings['settings_retention_days']}: {self._display_retention(max_age_days)}")
+        responses.append(f"{self.strings['settings_retention_max_rows']}: {self._display_retention(max_rows)}")
         await params.effective_message.reply_text("\n".join(responses))
 
+    @get_repost_params
+    @flood_protection("threshold")
+    async def _set_image_match_threshold(self,
+                                         update: Update,
+                                         context: CallbackContext,
+                                         params: RepostBotTelegramParams = None) -> None:
+        message = params.effective_message
+        max_threshold = self.repostitory.max_image_match_threshold
+        try:
+            threshold = int(context.args[0])
+        except (IndexError, ValueError):
+            threshold = None
+        if threshold is None or not 0 <= threshold <= max_threshold:
+            await message.reply_text(self.strings["invalid_threshold_reply"].format(max=max_threshold), quote=True)
+            return
+        await self.repostitory.save_image_match_threshold(params.group_id, threshold)
+        await message.reply_text(self.strings["threshold_command_reply"].format(threshold=threshold), quote=True)
+
+    @get_repost_params
+    @flood_protection("algorithm")
+    async def _set_hash_algorithm(self,
+                                  update: Update,
+                                  context: CallbackContext,
+                                  params: RepostBotTelegramParams = None) -> None:
+        message = params.effective_message
+        hash_algorithm = context.args[0] if len(context.args) > 0 else ""
+        if not is_hash_algorithm(hash_algorithm):
+            algorithms = ", ".join(get_all_hash_algorithms())
+            await message.reply_text(self.strings["invalid_algorithm_reply"].format(algorithms=algorithms), quote=True)
+            return
+        await self.repostitory.save_hash_algorithm(params.group_id, hash_algorithm)
+        hash_algorithm = await self.repostitory.get_hash_algorithm(params.group_id)
+        await message.reply_text(self.strings["algorithm_command_reply"].format(algorithm=hash_algorithm), quote=True)
+
+    @get_repost_params
+    @flood_protection("retention")
+    async def _set_retention(self,
+                             update: Update,
+                             context: CallbackContext,
+                             params: RepostBotTelegramParams = None) -> None:
+        message = params.effective_message
+        if not await self._is_admin(params.sender_id, message.chat):
+            await message.reply_text(self.strings["group_repost_reset_admin_only"])
+            return
+        try:
+            max_age_days = int(context.args[0])
+            max_rows = int(context.args[1]) if len(context.args) > 1 else 0
+        except (IndexError, ValueError):
+            max_age_days, max_rows = -1, -1
+        if max_age_days < 0 or max_rows < 0:
+            await message.reply_text(self.strings["invalid_retention_reply"], quote=True)
+            return
+        await self.repostitory.save_retention(params.group_id, max_age_days, max_rows)
+        await message.reply_text(self.strings["retention_command_reply"].format(
+            days=self._display_retention(max_age_days),
+            rows=self._display_retention(max_rows)
+        ), quote=True)
+
+    def _display_retention(self, limit: int) -> str:
+        return str(limit) if limit > 0 else self.strings["retention_unlimited"]
+
     @get_repost_params
     @flood_protection("whitelist")
     async def _whitelist_command(self,
@@ -279,18 +458,64 @@ class RepostBot:
                              update: Update,
                              context: CallbackContext,
                              params: RepostBotTelegramParams = None) -> None:
-        group_reposts: dict[str, list[int]] = self.repostitory.get_group_reposts(params.group_id)
-        url_reposts = dict()
-        image_reposts = dict()
-        for key, repost_list in group_reposts.items():
-            only_reposts = repost_list[1:]
-            (url_reposts if len(key) == URL_KEY_LENGTH else image_reposts).update({key: only_reposts})
-        num_unique_images = len(image_reposts.keys())
-        num_image_reposts = sum_list_lengths(image_reposts.values())
-        num_unique_urls = len(url_reposts.keys())
-        num_url_reposts = sum_list_lengths(url_reposts.values())
-        response = self.strings["stats_command_reply"].format(num_unique_images=num_unique_images,
-                                                              num_image_reposts=num_image_reposts,
-                                                              num_unique_urls=num_unique_urls,
-                                                              num_url_reposts=num_url_reposts)
+        group_stats = await self.repostitory.get_group_stats(params.group_id)
+        response = self.strings["stats_command_reply"].format(num_unique_images=group_stats.unique_pictures,
+                                                              num_image_reposts=group_stats.picture_reposts,
+                                                              num_unique_urls=group_stats.unique_urls,
+                                                              num_url_reposts=group_stats.url_reposts)
+        # the bot's own admin also gets the bloom filter's counts, which cover every group since the bot started
+        bloom_filter_stats = self.repostitory.get_bloom_filter_stats()
+        if params.sender_id == self.admin_id and bloom_filter_stats is not None:
+            response += self.strings["bloom_filter_stats_reply"].format(**bloom_filter_stats)
         await params.effective_message.reply_text(response, quote=True)
+
+    @get_repost_params
+    @flood_protection("leaderboard")
+    async def _leaderboard_command(self,
+                                   update: Update,
+                                   context: CallbackContext,
+                                   params: RepostBotTelegramParams = None) -> None:
+        message = params.effective_message
+        window_name = context.args[0] if len(context.args) > 0 else self.stats_windows[0].name
+        window = next((window for window in self.stats_windows if window.name == window_name), None)
+        if window is None:
+            windows = ", ".join(window.name for window in self.stats_windows)
+            await message.reply_text(self.strings["invalid_stats_window_reply"].format(windows=windows), quote=True)
+            return
+        leaderboard = await self.repostitory.get_leaderboard(params.group_id, window, self.leaderboard_size)
+        if len(leaderboard) == 0:
+            await message.reply_text(
+                self.strings["leaderboard_empty_reply"].format(window=window.display_name(self.strings)),
+                quote=True
+            )
+            return
+        names = await asyncio.gather(*(
+            self._get_member_name(context.bot, params.group_id, entry.user_id) for entry in leaderboard
+        ))
+        responses = [self.strings["leaderboard_command_reply"].format(window=window.display_name(self.strings))]
+        for rank, (entry, name) in enumerate(zip(leaderboard, names), start=1):
+            responses.append(self.strings["leaderboard_line"].format(rank=rank, name=name, reposts=entry.reposts))
+        await message.reply_text("\n".join(responses), quote=True)
+
+    @get_repost_params
+    @flood_protection("mystats")
+    async def _my_stats_command(self,
+                                update: Update,
+                                context: CallbackContext,
+                                params: RepostBotTelegramParams = None) -> None:
+        user_reposts = await self.repostitory.get_user_reposts(params.group_id, params.sender_id, self.stats_windows)
+        responses = [self.strings["my_stats_command_reply"].format(name=params.sender_name)]
+        for window, reposts in zip(self.stats_windows, user_reposts):
+            responses.append(self.strings["my_stats_line"].format(window=window.display_name(self.strings),
+                                                                  reposts=reposts))
+        await params.effective_message.reply_text("\n".join(responses), quote=True)
+
+    @staticmethod
+    async def _get_member_name(bot: Bot, group_id: int, user_id: int) -> str:
+        # names aren't stored, and people who left the group can't be looked up anymore
+        try:
+            member = await bot.get_chat_member(group_id, user_id)
+        except (Forbidden, BadRequest) as e:
+            logger.info(f"Couldn't look up user {user_id}: {e.message}")
+            return str(user_id)
+        return member.user.full_name
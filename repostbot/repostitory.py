@@ -1,19 +1,30 @@
+import asyncio
 import hashlib
 import logging
-import os
+import math
 from dataclasses import dataclass
+from datetime import date, datetime, timedelta
 from timeit import default_timer as timer
 
-import ujson as json
-from PIL import Image
-from imagehash import average_hash
 from telegram import Message
 from telegram import MessageEntity
+from telegram import MessageOriginChannel
+from telegram import PhotoSize
 
-from repostbot.db.deleted_messages_dao import DeletedMessagesDAO
-from repostbot.db.hash_whitelist_dao import HashWhitelistDAO
-from repostbot.db.repost_dao import RepostDAO
+from repostbot.bloom_filter import GroupBloomFilters
+from repostbot.db.group_stats_dao import GroupStats
+from repostbot.db.repost_dao import NewRepost
+from repostbot.db.user_stats_dao import UserReposts
+from repostbot.db.storage import RepostStorage
+from repostbot.file_hash_cache import FileHashCache
 from repostbot.group_settings import GroupSettings
+from repostbot.hash_algorithms import UNRECORDED_HASH_ALGORITHM, get_hash_algorithm_name
+from repostbot.hash_index import GroupHashIndex
+from repostbot.image_hashing import ImageHasher
+from repostbot.near_duplicates import NearDuplicateIndex
+from repostbot.photo_size_policy import PhotoSizePolicy
+from repostbot.retention import RetentionSettings
+from repostbot.stats_window import StatsWindow
 from repostbot.toggles import Toggles, ToggleType
 from repostbot.whitelist_status import WhitelistAddStatus
 from utils import RepostBotTelegramParams
@@ -30,57 +41,115 @@ class MessageEntityHashes:
         return len(self.url_hashes) + (1 if self.picture_hash else 0)
 
 
+def _get_forward_origin(message: Message) -> tuple[int, int] | None:
+    origin = message.forward_origin
+    if not isinstance(origin, MessageOriginChannel):
+        return None
+    return origin.chat.id, origin.message_id
+
+
 class Repostitory:
     def __init__(self,
                  hash_size: int,
-                 data_path: str,
-                 default_toggles: dict[ToggleType, bool]):
-        self.data_path = data_path
+                 default_toggles: dict[ToggleType, bool],
+                 storage: RepostStorage,
+                 hash_index: GroupHashIndex,
+                 bloom_filters: GroupBloomFilters,
+                 near_duplicate_index: NearDuplicateIndex,
+                 default_image_match_threshold: int,
+                 max_image_match_threshold: int,
+                 default_hash_algorithm: str,
+                 image_hasher: ImageHasher,
+                 photo_size_policy: PhotoSizePolicy,
+                 file_hash_cache: FileHashCache,
+                 retention_settings: RetentionSettings):
         self.default_toggles = default_toggles
         self.hash_size = hash_size
-        self._check_directory()
+        self.storage = storage
+        self.hash_index = hash_index
+        self.bloom_filters = bloom_filters
+        self.near_duplicate_index = near_duplicate_index
+        self.default_image_match_threshold = default_image_match_threshold
+        self.max_image_match_threshold = max_image_match_threshold
+        self.default_hash_algorithm = default_hash_algorithm
+        self.image_hasher = image_hasher
+        self.photo_size_policy = photo_size_policy
+        self.file_hash_cache = file_hash_cache
+        self.retention_settings = retention_settings
+        self._retention_runs = 0
+        self._group_settings: dict[int, GroupSettings] = dict()
+        self._group_locks: dict[int, asyncio.Lock] = dict()
+
+    async def start(self) -> None:
+        if self.bloom_filters.enabled:
+            logger.info("Building bloom filters from stored reposts")
+            filters = await self.storage.scan_all_group_hashes(self.bloom_filters.build)
+            self.bloom_filters.finish_build(filters)
 
     async def process_message_entities(self, params: RepostBotTelegramParams) -> dict[str, list[int]]:
-        group_id = params.group_id
-        self._ensure_group_file(group_id)
-        message = params.effective_message
-        hash_result = await self.get_message_entity_hashes(message)
-        picture_key = hash_result.picture_hash
-        url_keys = hash_result.url_hashes
-        message_id = message.message_id
-        hashes = set()
-        toggles = self.get_toggles_data(group_id)
-        if picture_key is not None and toggles.track_pictures:
-            hashes.add(picture_key)
-        if toggles.track_urls:
-            hashes.update(url_keys)
-        user_id = message.from_user.id
-        # optimize the next two lines. insert_then_retrieve or something
-        RepostDAO.insert_reposts_for_group(group_id, user_id, message_id, hashes)
-        reposts = RepostDAO.get_group_reposts(group_id)
-        whitelist = HashWhitelistDAO.get_whitelisted_hashes_for_group(group_id)
-        return {
-            entity_hash: reposts.get(entity_hash, [])
-            for entity_hash in hashes
-            if entity_hash not in whitelist
-        }
-
-    def save_group_data(self, group_id: int, new_group_data: GroupSettings) -> None:
-        with open(self._get_path_for_group_data(group_id), 'w') as f:
-            json.dump(new_group_data.to_dict(), f, indent=2)
-
-    def get_group_data_json(self, group_id: int) -> GroupSettings:
-        self._ensure_group_file(group_id)
-        with open(self._get_path_for_group_data(group_id)) as f:
-            data = json.load(f)
-        return GroupSettings(data)
-
-    def get_group_reposts(self, group_id: int) -> dict[str, list[int]]:
-        return RepostDAO.get_group_reposts(group_id)
+        return (await self.process_album_entities([params]))[0]
+
+    async def process_album_entities(self, album: list[RepostBotTelegramParams]) -> list[dict[str, list[int]]]:
+        group_id = album[0].group_id
+        hash_algorithm = await self.get_hash_algorithm(group_id)
+        # every picture in an album is downloaded at the same time and hashed in one batch
+        hash_results = await self.get_album_entity_hashes([params.effective_message for params in album],
+                                                          group_id,
+                                                          hash_algorithm)
+        toggles = await self.get_toggles_data(group_id)
+        reposts = []
+        for params, hash_result in zip(album, hash_results):
+            message = params.effective_message
+            picture_key = hash_result.picture_hash if toggles.track_pictures else None
+            hashes = set()
+            if picture_key is not None:
+                hashes.add(picture_key)
+            if toggles.track_urls:
+                hashes.update(hash_result.url_hashes)
+            reposts.append(NewRepost(message.from_user.id,
+                                     message.message_id,
+                                     frozenset(hashes),
+                                     picture_key,
+                                     hash_algorithm if picture_key is not None else None))
+        image_match_threshold = self.photo_size_policy.image_match_threshold(
+            await self.get_image_match_threshold(group_id)
+        )
+        results = await self._insert_and_get_reposts(group_id, reposts, image_match_threshold)
+        whitelist = await self.storage.get_whitelisted_hashes(group_id)
+        return [
+            {
+                entity_hash: result.get(entity_hash, [])
+                for entity_hash in repost.hashes
+                if entity_hash not in whitelist
+            }
+            for repost, result in zip(reposts, results)
+        ]
+
+    async def save_group_settings(self, group_id: int, new_group_settings: GroupSettings) -> None:
+        new_group_settings = new_group_settings.copy()
+        await self.storage.save_group_settings(group_id, new_group_settings)
+        self._group_settings[group_id] = new_group_settings
+
+    async def get_group_settings(self, group_id: int) -> GroupSettings:
+        # a copy, so changes only take effect once they're saved
+        return (await self._get_group_settings(group_id)).copy()
+
+    async def get_group_stats(self, group_id: int) -> GroupStats:
+        return await self.storage.get_group_stats(group_id)
+
+    def get_bloom_filter_stats(self) -> dict[str, int] | None:
+        return self.bloom_filters.stats() if self.bloom_filters.enabled else None
+
+    async def get_leaderboard(self, group_id: int, window: StatsWindow, limit: int) -> list[UserReposts]:
+        return await self.storage.get_leaderboard(group_id, window.since(date.today()), limit)
+
+    async def get_user_reposts(self, group_id: int, user_id: int, windows: list[StatsWindow]) -> list[int]:
+        today = date.today()
+        return await self.storage.get_user_reposts(group_id, user_id, [window.since(today) for window in windows])
 
     async def process_whitelist_command(self, message: Message, group_id: int) -> WhitelistAddStatus:
-        whitelisted_hashes: set[str] = HashWhitelistDAO.get_whitelisted_hashes_for_group(group_id)
-        hashes = await self.get_message_entity_hashes(message)
+        whitelisted_hashes: set[str] = await self.storage.get_whitelisted_hashes(group_id)
+        hashes = await self.get_message_entity_hashes(message, group_id, await self.get_hash_algorithm(group_id))
         if len(hashes) == 0:
             return WhitelistAddStatus.FAIL
         picture_key = hashes.picture_hash
@@ -91,11 +160,11 @@ class Repostitory:
 
         hashes_were_removed = len(message_keys_to_remove) > 0
         if hashes_were_removed:
-            HashWhitelistDAO.remove_all_whitelist_hashes_for_group(group_id)
+            await self.storage.remove_all_whitelist_hashes(group_id)
 
         hashes_should_be_added = len(message_keys_to_add) > 0
         if hashes_should_be_added:
-            HashWhitelistDAO.insert_whitelist_hashes_for_group(group_id, message_keys_to_add)
+            await self.storage.insert_whitelist_hashes(group_id, message_keys_to_add)
 
         match hashes_were_removed, hashes_should_be_added:
             case True, False:
@@ -107,64 +176,308 @@ class Repostitory:
             case _:
                 return WhitelistAddStatus.FAIL
 
-    def reset_group_repost_data(self, group_id: int) -> None:
-        self.save_group_data(group_id, self._get_empty_group_file_structure())
-        RepostDAO.remove_all_for_group(group_id)
-        HashWhitelistDAO.remove_all_whitelist_hashes_for_group(group_id)
-        DeletedMessagesDAO.remove_all_deleted_message_records_for_group(group_id)
+    async def reset_group_repost_data(self, group_id: int) -> None:
+        async with self._group_lock(group_id):
+            self.hash_index.discard(group_id)
+            self.bloom_filters.discard(group_id)
+            self.near_duplicate_index.discard(group_id)
+            # the group's settings row goes too, so it's back on the defaults
+            await self.storage.remove_all_for_group(group_id)
+            self._group_settings.pop(group_id, None)
 
-    def get_toggles_data(self, group_id: int) -> Toggles:
-        return self.get_group_data_json(group_id).toggles.merged(Toggles(self.default_toggles))
+    async def get_retention(self, group_id: int) -> tuple[int, int]:
+        return self._get_retention(await self._get_group_settings(group_id))
 
-    def save_toggles_data(self, group_id: int, toggles: Toggles):
-        group_data = self.get_group_data_json(group_id)
+    def _get_retention(self, group_settings: GroupSettings) -> tuple[int, int]:
+        max_age_days = group_settings.retention_days
+        max_rows = group_settings.retention_max_rows
+        return (max_age_days if max_age_days is not None else self.retention_settings.max_age_days,
+                max_rows if max_rows is not None else self.retention_settings.max_rows)
+
+    async def save_retention(self, group_id: int, max_age_days: int, max_rows: int) -> None:
+        group_data = await self.get_group_settings(group_id)
+        group_data.retention_days = max_age_days
+        group_data.retention_max_rows = max_rows
+        await self.save_group_settings(group_id, group_data)
+
+    async def apply_retention(self) -> int:
+        start = timer()
+        settings = self.retention_settings
+        removed = 0
+        for group_id in await self.storage.get_retention_group_ids():
+            # not cached, so a run doesn't keep every group's settings in memory whether it's active or not
+            max_age_days, max_rows = self._get_retention(await self._get_group_settings(group_id, cache=False))
+            if max_age_days <= 0 and max_rows <= 0:
+                continue
+            before = datetime.now() - timedelta(days=max_age_days) if max_age_days > 0 else None
+            group_removed = await self.storage.remove_reposts_past_retention(group_id,
+                                                                            before,
+                                                                            max_rows if max_rows > 0 else None,
+                                                                            settings.batch_size,
+                                                                            settings.batch_pause_ms)
+            if group_removed > 0:
+                # what's kept in memory would still point at the removed reposts
+                async with self._group_lock(group_id):
+                    self.hash_index.discard(group_id)
+                    self.near_duplicate_index.discard(group_id)
+                removed += group_removed
+        removed_file_hashes = 0
+        if settings.file_hash_max_age_days > 0:
+            # only the database's copy; the in-memory cache is bounded on its own
+            removed_file_hashes = await self.storage.remove_file_hashes_unused_since(
+                datetime.now() - timedelta(days=settings.file_hash_max_age_days),
+                settings.batch_size,
+                settings.batch_pause_ms
+            )
+        self._retention_runs += 1
+        analyze = settings.analyze_every > 0 and self._retention_runs % settings.analyze_every == 0
+        await self.storage.compact(analyze, settings.vacuum_pages)
+        logger.info(f"Removed {removed} reposts past retention and {removed_file_hashes} unused file hashes "
+                    f"in {timer() - start:.2f} s{', analyzed the database' if analyze else ''}")
+        return removed
+
+    async def get_toggles_data(self, group_id: int) -> Toggles:
+        return (await self._get_group_settings(group_id)).toggles.merged(Toggles(self.default_toggles))
+
+    async def get_image_match_threshold(self, group_id: int) -> int:
+        threshold = (await self._get_group_settings(group_id)).image_match_threshold
+        return threshold if threshold is not None else self.default_image_match_threshold
+
+    async def save_image_match_threshold(self, group_id: int, threshold: int) -> None:
+        group_data = await self.get_group_settings(group_id)
+        group_data.image_match_threshold = threshold
+        await self.save_group_settings(group_id, group_data)
+
+    async def get_hash_algorithm(self, group_id: int) -> str:
+        hash_algorithm = (await self._get_group_settings(group_id)).hash_algorithm
+        return get_hash_algorithm_name(hash_algorithm if hash_algorithm is not None else self.default_hash_algorithm)
+
+    async def save_hash_algorithm(self, group_id: int, hash_algorithm: str) -> None:
+        group_data = await self.get_group_settings(group_id)
+        group_data.hash_algorithm = get_hash_algorithm_name(hash_algorithm)
+        await self.save_group_settings(group_id, group_data)
+        # what's kept in memory was built from the pictures hashed with the old algorithm
+        async with self._group_lock(group_id):
+            self.hash_index.discard(group_id)
+            self.near_duplicate_index.discard(group_id)
+
+    async def save_toggles_data(self, group_id: int, toggles: Toggles):
+        group_data = await self.get_group_settings(group_id)
         current_toggles = group_data.toggles.merged(Toggles(self.default_toggles))
         new_toggles = {**current_toggles.as_dict(), **toggles.as_dict()}
         group_data.toggles = new_toggles
-        self.save_group_data(group_id, group_data)
-
-    async def get_message_entity_hashes(self, message: Message) -> MessageEntityHashes:
-        picture_hash = None
-        if message.photo:
-            photo = message.photo[-1]
-            path = f"{photo.file_id}.jpg"
-            start_time = timer()
-            logger.info("Getting file...")
-            file = await message.get_bot().get_file(photo)
-            await file.download_to_drive(path)
-            end_time = timer()
-            logger.info(f"Done (took {(end_time - start_time):.2f} seconds)")
-            with Image.open(path) as f:
-                picture_hash = str(average_hash(f, hash_size=self.hash_size))
-            os.remove(path)
-
-        url_message_entity_types = [MessageEntity.URL, MessageEntity.TEXT_LINK]
-        message_urls = set(message.parse_entities(types=url_message_entity_types).values())
-        caption_urls = set(message.parse_caption_entities(types=url_message_entity_types).values())
-        urls = message_urls.union(caption_urls)
-        url_hashes = {hashlib.sha256(bytes(url, 'utf-8')).hexdigest() for url in urls}
-
-        return MessageEntityHashes(picture_hash, url_hashes)
-
-    def get_deleted_messages(self, group_id) -> set[int]:
-        return DeletedMessagesDAO.get_deleted_messages_for_group(group_id)
-
-    def updated_deleted_messages(self, group_id: int, newly_deleted_messages: set[int]) -> None:
-        DeletedMessagesDAO.insert_deleted_messages_for_group(group_id, newly_deleted_messages)
-
-    def _ensure_group_file(self, group_id: int) -> None:
-        self._check_directory()
-        if not os.path.isfile(self._get_path_for_group_data(group_id)):
-            logger.info("Group has no file; making one")
-            with open(self._get_path_for_group_data(group_id), 'w') as f:
-                json.dump(self._get_empty_group_file_structure().to_dict(), f, indent=2)
-
-    def _get_path_for_group_data(self, group_id: int | str) -> str:
-        return f"{self.data_path}/{group_id}.json"
-
-    def _check_directory(self) -> None:
-        if not os.path.exists(self.data_path):
-            os.makedirs(self.data_path)
-
-    def _get_empty_group_file_structure(self) -> GroupSettings:
-        return GroupSettings.blank(self.default_toggles)
+        await self.save_group_settings(group_id, group_data)
+
+    async def get_message_entity_hashes(self,
+                                        message: Message,
+                                        group_id: int,
+                                        hash_algorithm: str) -> MessageEntityHashes:
+        return (await self.get_album_entity_hashes([message], group_id, hash_algorithm))[0]
+
+    async def get_album_entity_hashes(self,
+                                      messages: list[Message],
+                                      group_id: int,
+                                      hash_algorithm: str) -> list[MessageEntityHashes]:
+        picture_hashes = await self._get_picture_hashes(messages, group_id, hash_algorithm)
+        results = []
+        for message, picture_hash in zip(messages, picture_hashes):
+            url_message_entity_types = [MessageEntity.URL, MessageEntity.TEXT_LINK]
+            message_urls = set(message.parse_entities(types=url_message_entity_types).values())
+            caption_urls = set(message.parse_caption_entities(types=url_message_entity_types).values())
+            urls = message_urls.union(caption_urls)
+            url_hashes = {hashlib.sha256(bytes(url, 'utf-8')).hexdigest() for url in urls}
+            results.append(MessageEntityHashes(picture_hash, url_hashes))
+        return results
+
+    async def _get_picture_hashes(self,
+                                  messages: list[Message],
+                                  group_id: int,
+                                  hash_algorithm: str) -> list[str | None]:
+        picture_hashes: list[str | None] = [None] * len(messages)
+        cache_algorithm = self.image_hasher.cache_algorithm(hash_algorithm)
+        with_photo = [i for i, message in enumerate(messages) if message.photo]
+        forwarded_hashes = await asyncio.gather(*(
+            self._get_forwarded_picture_hash(messages[i], group_id, cache_algorithm) for i in with_photo
+        ))
+        photos: dict[int, PhotoSize] = dict()
+        for i, forwarded_hash in zip(with_photo, forwarded_hashes):
+            picture_hashes[i] = forwarded_hash
+            if forwarded_hash is None:
+                photos[i] = self.photo_size_policy.select(messages[i].photo)
+        known_hashes = await asyncio.gather(*(self._get_known_picture_hash(photo, cache_algorithm)
+                                              for photo in photos.values()))
+        for i, known_hash in zip(photos, known_hashes):
+            picture_hashes[i] = known_hash
+        to_hash = [i for i in photos if picture_hashes[i] is None]
+        if len(to_hash) > 0:
+            new_hashes = await self._hash_pictures([messages[i] for i in to_hash],
+                                                   [photos[i] for i in to_hash],
+                                                   hash_algorithm,
+                                                   cache_algorithm)
+            for i, new_hash in zip(to_hash, new_hashes):
+                picture_hashes[i] = new_hash
+        for i, photo in photos.items():
+            self.file_hash_cache.put(photo.file_unique_id, self.hash_size, cache_algorithm, picture_hashes[i])
+            await self._save_forwarded_picture_hash(messages[i], group_id, cache_algorithm, picture_hashes[i])
+        return picture_hashes
+
+    async def _get_forwarded_picture_hash(self, message: Message, group_id: int, cache_algorithm: str) -> str | None:
+        # a forwarded channel post is the same content every time it comes in, so its origin identifies the picture
+        origin = _get_forward_origin(message)
+        if origin is None:
+            return None
+        return await self.storage.get_forwarded_hash(group_id, *origin, cache_algorithm)
+
+    async def _save_forwarded_picture_hash(self,
+                                           message: Message,
+                                           group_id: int,
+                                           cache_algorithm: str,
+                                           picture_hash: str) -> None:
+        origin = _get_forward_origin(message)
+        if origin is not None:
+            await self.storage.insert_forwarded_hash(group_id, *origin, cache_algorithm, picture_hash)
+
+    async def _get_known_picture_hash(self, photo: PhotoSize, cache_algorithm: str) -> str | None:
+        # telegram keeps the same file_unique_id when a picture is forwarded or sent again, so its hash can be reused
+        picture_hash = self.file_hash_cache.get(photo.file_unique_id, self.hash_size, cache_algorithm)
+        if picture_hash is not None:
+            return picture_hash
+        return await self.storage.get_file_hash(photo.file_unique_id, self.hash_size, cache_algorithm)
+
+    async def _hash_pictures(self,
+                             messages: list[Message],
+                             photos: list[PhotoSize],
+                             hash_algorithm: str,
+                             cache_algorithm: str) -> list[str]:
+        start_time = timer()
+        logger.info(f"Getting {len(photos)} file(s)...")
+        files = await asyncio.gather(*(message.get_bot().get_file(photo) for message, photo in zip(messages, photos)))
+        picture_hashes = await self.image_hasher.hash_telegram_files(list(files), hash_algorithm)
+        end_time = timer()
+        logger.info(f"Done (took {(end_time - start_time):.2f} seconds)")
+        for photo, picture_hash in zip(photos, picture_hashes):
+            await self.storage.insert_file_hash(photo.file_unique_id, self.hash_size, cache_algorithm, picture_hash)
+        return picture_hashes
+
+    async def get_deleted_messages(self, group_id: int, message_ids: set[int]) -> set[int]:
+        return await self.storage.get_deleted_messages(group_id, message_ids)
+
+    async def updated_deleted_messages(self, group_id: int, newly_deleted_messages: set[int]) -> None:
+        await self.storage.insert_deleted_messages(group_id, newly_deleted_messages)
+
+    async def _insert_and_get_reposts(self,
+                                      group_id: int,
+                                      reposts: list[NewRepost],
+                                      image_match_threshold: int) -> list[dict[str, list[int]]]:
+        all_hashes = set().union(*(repost.hashes for repost in reposts))
+        if len(all_hashes) == 0:
+            return [dict() for _ in reposts]
+        # one message or album per group at a time, so each one always sees the ones that came before it
+        async with self._group_lock(group_id):
+            near_duplicates = []
+            for repost in reposts:
+                matches = set()
+                if repost.image_hash is not None:
+                    if image_match_threshold > 0:
+                        matches = await self._find_near_duplicates(group_id, repost.hash_algorithm, repost.image_hash,
+                                                                   image_match_threshold)
+                    # added straight away so later pictures in an album are compared with this one too
+                    self.near_duplicate_index.add(group_id, repost.hash_algorithm, repost.image_hash)
+                near_duplicates.append(matches)
+            repeated_in_batch = sum(len(repost.hashes) for repost in reposts) > len(all_hashes)
+            # asked every time, so a false positive is only counted when it was the filter that let the batch through
+            filter_consulted = self.bloom_filters.ready
+            in_bloom_filter = self.bloom_filters.might_contain_any(group_id, all_hashes)
+            might_be_repost = (repeated_in_batch
+                               or any(len(matches) > 0 for matches in near_duplicates)
+                               or in_bloom_filter)
+            self.bloom_filters.add(group_id, all_hashes)
+            if not might_be_repost:
+                for repost in reposts:
+                    if self.hash_index.get(group_id) is not None:
+                        self.hash_index.add(group_id, repost.message_id, repost.hashes)
+                await self.storage.insert_reposts_for_messages(group_id, reposts)
+                return [{entity_hash: [repost.message_id] for entity_hash in repost.hashes} for repost in reposts]
+
+            if self.hash_index.can_hold(group_id) and self.hash_index.get(group_id) is None:
+                self.hash_index.put(group_id, await self.storage.get_group_reposts(group_id))
+            results = []
+            for repost in reposts:
+                if self.hash_index.get(group_id) is None:
+                    break
+                results.append(self.hash_index.add(group_id, repost.message_id, repost.hashes))
+            if len(results) > 0:
+                await self.storage.insert_reposts_for_messages(group_id, reposts[:len(results)])
+            if len(results) < len(reposts):
+                # not in memory, or it outgrew the memory budget part way through an album
+                results += await self.storage.insert_and_get_reposts_for_messages(group_id, reposts[len(results):])
+
+            near_duplicate_hashes = set().union(*near_duplicates)
+            if len(near_duplicate_hashes) > 0:
+                near_duplicate_reposts = await self._get_reposts_for_hashes(group_id, near_duplicate_hashes)
+                for repost, matches, result in zip(reposts, near_duplicates, results):
+                    if len(matches) == 0:
+                        continue
+                    result[repost.image_hash] = sorted({
+                        *result[repost.image_hash],
+                        *(
+                            message_id
+                            for near_duplicate_hash in matches
+                            for message_id in near_duplicate_reposts.get(near_duplicate_hash, [])
+                            if message_id < repost.message_id
+                        )
+                    })
+
+        if filter_consulted and in_bloom_filter and all(len(message_ids) == 1
+                                                        for result in results
+                                                        for message_ids in result.values()):
+            self.bloom_filters.record_false_positive()
+        return results
+
+    async def _find_near_duplicates(self,
+                                    group_id: int,
+                                    hash_algorithm: str,
+                                    image_hash: str,
+                                    threshold: int) -> set[str]:
+        search = self.near_duplicate_index.get(group_id, hash_algorithm)
+        if search is None:
+            group_hashes = await self.storage.get_group_picture_hashes(group_id, hash_algorithm,
+                                                                       hash_algorithm == UNRECORDED_HASH_ALGORITHM)
+            search = self.near_duplicate_index.put(group_id, hash_algorithm,
+                                                   filter(self._is_image_hash, group_hashes))
+        return search.search(image_hash, threshold).difference({image_hash})
+
+    async def _get_reposts_for_hashes(self, group_id: int, hashes: set[str]) -> dict[str, list[int]]:
+        group_reposts = self.hash_index.get(group_id)
+        if group_reposts is not None:
+            return {entity_hash: group_reposts.get(entity_hash, []) for entity_hash in hashes}
+        return await self.storage.get_reposts_for_hashes(group_id, hashes)
+
+    def _is_image_hash(self, entity_hash: str) -> bool:
+        # pictures hashed at another hash size can't be compared
+        return len(entity_hash) == math.ceil(self.hash_size ** 2 / 8) * 2
+
+    def _group_lock(self, group_id: int) -> asyncio.Lock:
+        if group_id not in self._group_locks:
+            self._group_locks[group_id] = asyncio.Lock()
+        return self._group_locks[group_id]
+
+    async def close(self) -> None:
+        if self.bloom_filters.enabled:
+            logger.info(f"Bloom filter stats: {self.bloom_filters.stats()}")
+        logger.info(f"File hash cache stats: {self.file_hash_cache.stats()}")
+        await self.image_hasher.close()
+        await self.storage.close()
+
+    async def _get_group_settings(self, group_id: int, cache: bool = True) -> GroupSettings:
+        group_settings = self._group_settings.get(group_id)
+        if group_settings is not None:
+            return group_settings
+        group_settings = await self.storage.get_group_settings(group_id)
+        if group_settings is None:
+            # nothing has been changed for the group yet, so every setting uses its default
+            group_settings = GroupSettings.blank(dict())
+        if not cache:
+            return group_settings
+        # a save that finished while this was being read is newer, so it's kept
+        return self._group_settings.setdefault(group_id, group_settings)
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, fields
+from typing import Any
+
+
+@dataclass(frozen=True)
+class RetentionSettings:
+    max_age_days: int = 0
+    max_rows: int = 0
+    interval_minutes: int = 60
+    batch_size: int = 1000
+    batch_pause_ms: int = 50
+    analyze_every: int = 24
+    vacuum_pages: int = 1000
+    file_hash_max_age_days: int = 90
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval_minutes > 0
+
+    @staticmethod
+    def from_dict(data: dict[str, Any] | None) -> RetentionSettings:
+        known_fields = {field.name for field in fields(RetentionSettings)}
+        settings = RetentionSettings(**{key: value for key, value in (data or {}).items() if key in known_fields})
+        if settings.batch_size <= 0:
+            raise ValueError(f"Retention batch size has to be above 0, not {settings.batch_size}")
+        return settings
@@ -0,0 +1,31 @@
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+_DAYS_PATTERN = re.compile(r'^(\d+)d$')
+
+ALL_TIME = "all"
+
+
+@dataclass(frozen=True)
+class StatsWindow:
+    name: str
+    days: int | None
+
+    def since(self, today: date) -> date | None:
+        # today counts as one of the days
+        return today - timedelta(days=self.days - 1) if self.days is not None else None
+
+    def display_name(self, strings: dict[str, str | list[str]]) -> str:
+        if self.days is None:
+            return strings["stats_window_all_time"]
+        return strings["stats_window_days"].format(days=self.days)
+
+
+def get_stats_window(name: str) -> StatsWindow:
+    if name == ALL_TIME:
+        return StatsWindow(name, None)
+    match = _DAYS_PATTERN.match(name)
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError(f"Stats windows are a number of days like \"7d\" or \"{ALL_TIME}\", not \"{name}\"")
+    return StatsWindow(name, int(match.group(1)))
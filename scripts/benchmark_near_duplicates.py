@@ -0,0 +1,61 @@
+import argparse
+import os
+import random
+import sys
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+from repostbot.near_duplicates import BKTree, PackedHashScan, NearDuplicateSearch  # noqa: E402
+
+
+def _random_hashes(count: int, bits: int) -> list[str]:
+    width = -(-bits // 4)
+    return [format(random.getrandbits(bits), f'0{width}x') for _ in range(count)]
+
+
+def _flip_bits(image_hash: str, bits: int, flips: int) -> str:
+    value = int(image_hash, 16)
+    for bit in random.sample(range(bits), flips):
+        value ^= 1 << bit
+    return format(value, f'0{len(image_hash)}x')
+
+
+def _time_queries(search_fn, queries: list[str]) -> float:
+    start = timer()
+    for query in queries:
+        search_fn(query)
+    return (timer() - start) / len(queries)
+
+
+def _benchmark(size: int, bits: int, threshold: int, num_queries: int, include_tree: bool):
+    stored = _random_hashes(size, bits)
+    queries = [_flip_bits(random.choice(stored), bits, threshold) for _ in range(num_queries)]
+    print(f"\n{size:,} hashes of {bits} bits, threshold {threshold}, {num_queries} queries")
+
+    exact = {image_hash: [message_id] for message_id, image_hash in enumerate(stored)}
+    exact_time = _time_queries(exact.get, queries)
+    print(f"  exact dict lookup:  {exact_time * 1e6:12.2f} us/query (only finds exact copies)")
+
+    searches: list[type[NearDuplicateSearch]] = [PackedHashScan, BKTree] if include_tree else [PackedHashScan]
+    for search_type in searches:
+        start = timer()
+        search = search_type(stored)
+        build_time = timer() - start
+        query_time = _time_queries(lambda query: search.search(query, threshold), queries)
+        print(f"  {search_type.__name__ + ':':19} {query_time * 1e6:12.2f} us/query, built in {build_time:.2f} s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare near-duplicate searches with the exact hash lookup')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--hash-size', type=int, default=22,
+                        help='hash_size from the config; hashes have hash_size^2 bits')
+    parser.add_argument('--threshold', type=int, default=6)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--skip-tree-above', type=int, default=100_000,
+                        help="don't build a BK-tree for sizes above this; it takes a long time in pure python")
+    args = parser.parse_args()
+    random.seed(0)
+    for size in args.sizes:
+        _benchmark(size, args.hash_size ** 2, args.threshold, args.queries, size <= args.skip_tree_above)
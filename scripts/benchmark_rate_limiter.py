@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+from utils.rate_limiter import RateLimiter  # noqa: E402
+
+_COMMANDS = ["call_out_reposts", "toggle", "settings", "stats", "whitelist"]
+
+
+class _GlobalLockFloodTrack:
+    # how flood protection worked before: one dict of users, rebuilt after every allowed command
+    def __init__(self, clock):
+        self._clock = clock
+        self._flood_track: dict[int, dict[str, datetime]] = dict()
+
+    def add_users(self, user_ids: range):
+        # users were never removed from it, only their commands, so it ends up holding everyone who's used the bot
+        self._flood_track.update({user_id: dict() for user_id in user_ids})
+
+    def try_acquire(self, key: tuple[int, str], cooldown: float) -> bool:
+        user_id, command_key = key
+        if self._flood_track.get(user_id) is None:
+            self._flood_track[user_id] = dict()
+        last_called = self._flood_track[user_id].get(command_key)
+        now = self._clock()
+        if last_called is None or (now - last_called).total_seconds() > cooldown:
+            self._flood_track = {
+                user_id: {
+                    command_key: last_command_called
+                    for command_key, last_command_called in commands.items()
+                    if (now - last_command_called).total_seconds() > cooldown
+                }
+                for user_id, commands in self._flood_track.items()
+            }
+            self._flood_track.setdefault(user_id, dict())[command_key] = now
+            return True
+        return False
+
+
+def _simulated_calls(num_users: int, num_calls: int) -> list[tuple[int, str]]:
+    return [(random.randrange(num_users), random.choice(_COMMANDS)) for _ in range(num_calls)]
+
+
+def _time_limiter(limiter, calls: list[tuple[int, str]], cooldown: float, advance) -> tuple[float, int]:
+    allowed = 0
+    start = timer()
+    for key in calls:
+        advance()
+        allowed += limiter.try_acquire(key, cooldown)
+    return (timer() - start) / len(calls), allowed
+
+
+def _benchmark_throughput(num_users: int, num_calls: int, legacy_calls: int, cooldown: float, calls_per_second: int):
+    print(f"\n{num_users:,} simulated users, {calls_per_second:,} commands per simulated second, {cooldown} s cooldown")
+    calls = _simulated_calls(num_users, num_calls)
+
+    # the clocks are simulated so the amount of state matches a bot that's been running at this rate
+    step = 1 / calls_per_second
+    seconds = [0.0]
+
+    def advance():
+        seconds[0] += step
+
+    limiter = RateLimiter(clock=lambda: seconds[0])
+    per_call, allowed = _time_limiter(limiter, calls, cooldown, advance)
+    print(f"  RateLimiter:        {per_call * 1e6:10.2f} us/command, {allowed:,} of {num_calls:,} allowed, "
+          f"{len(limiter):,} keys tracked at the end")
+
+    seconds[0] = 0.0
+    start_time = datetime.now()
+    legacy = _GlobalLockFloodTrack(lambda: start_time + timedelta(seconds=seconds[0]))
+    legacy.add_users(range(num_users))
+    per_call, allowed = _time_limiter(legacy, calls[:legacy_calls], cooldown, advance)
+    print(f"  old flood tracking: {per_call * 1e6:10.2f} us/command, {allowed:,} of {legacy_calls:,} allowed "
+          f"(only the first {legacy_calls:,} commands; the rest would take too long)")
+
+
+async def _benchmark_concurrency(num_commands: int, command_ms: float):
+    # commands from different users that each await telegram for command_ms
+    print(f"\n{num_commands} commands from different users at once, each awaiting I/O for {command_ms} ms")
+
+    async def command():
+        await asyncio.sleep(command_ms / 1000)
+
+    lock = asyncio.Lock()
+
+    async def old_wrapped():
+        async with lock:
+            await command()
+
+    limiter = RateLimiter()
+
+    async def new_wrapped(user_id: int):
+        if limiter.try_acquire((user_id, "settings"), 2):
+            await command()
+
+    start = timer()
+    await asyncio.gather(*(old_wrapped() for _ in range(num_commands)))
+    print(f"  lock held across the command: {timer() - start:8.3f} s")
+    start = timer()
+    await asyncio.gather(*(new_wrapped(user_id) for user_id in range(num_commands)))
+    print(f"  RateLimiter:                  {timer() - start:8.3f} s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the flood protection rate limiter with the old tracking')
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--commands', type=int, default=1_000_000)
+    parser.add_argument('--legacy-commands', type=int, default=200,
+                        help='commands to run through the old tracking, which gets slower with every user')
+    parser.add_argument('--cooldown', type=float, default=2, help='flood_protection_timeout from the config')
+    parser.add_argument('--rate', type=int, default=5_000, help='commands per simulated second')
+    parser.add_argument('--concurrent', type=int, default=200)
+    parser.add_argument('--command-ms', type=float, default=10)
+    args = parser.parse_args()
+    random.seed(0)
+    _benchmark_throughput(args.users, args.commands, args.legacy_commands, args.cooldown, args.rate)
+    asyncio.run(_benchmark_concurrency(args.concurrent, args.command_ms))
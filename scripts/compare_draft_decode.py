@@ -0,0 +1,65 @@
+import argparse
+import os
+import sys
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+from repostbot.hash_algorithms import DEFAULT_HASH_ALGORITHM, get_all_hash_algorithms  # noqa: E402
+from repostbot.image_hashing import hash_images  # noqa: E402
+
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def _image_paths(paths: list[str]) -> list[str]:
+    image_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, file_names in os.walk(path):
+                image_paths.extend(os.path.join(directory, file_name)
+                                   for file_name in sorted(file_names)
+                                   if file_name.lower().endswith(_IMAGE_EXTENSIONS))
+        else:
+            image_paths.append(path)
+    return image_paths
+
+
+def _hash_all(paths: list[str], hash_size: int, algorithm: str, draft_decode: bool) -> tuple[list[str], float]:
+    start = timer()
+    hashes = hash_images(paths, hash_size, algorithm, draft_decode)
+    return hashes, timer() - start
+
+
+def _compare(paths: list[str], hash_size: int, algorithm: str, threshold: int):
+    full_hashes, full_time = _hash_all(paths, hash_size, algorithm, False)
+    draft_hashes, draft_time = _hash_all(paths, hash_size, algorithm, True)
+    distances = [(int(full, 16) ^ int(draft, 16)).bit_count() for full, draft in zip(full_hashes, draft_hashes)]
+
+    print(f"{len(paths)} pictures, {algorithm} with hash size {hash_size}")
+    print(f"  full decode:  {full_time / len(paths) * 1e3:8.2f} ms/picture")
+    print(f"  draft decode: {draft_time / len(paths) * 1e3:8.2f} ms/picture")
+    print(f"  identical hashes: {distances.count(0)} ({distances.count(0) / len(paths):.1%})")
+    print(f"  mean drift: {sum(distances) / len(paths):.2f} bits, max drift: {max(distances)} bits")
+    for distance in sorted(set(distances)):
+        print(f"    {distance:3} bits: {distances.count(distance)}")
+    over_threshold = [path for path, distance in zip(paths, distances) if distance > threshold]
+    if len(over_threshold) > 0:
+        print(f"  {len(over_threshold)} picture(s) drifted more than {threshold} bits:")
+        for path in over_threshold:
+            print(f"    {path}")
+    return len(over_threshold) == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare picture hashes from a full decode with reduced-resolution '
+                                                 'jpeg decoding')
+    parser.add_argument('paths', nargs='+', help='pictures, or directories to search for pictures')
+    parser.add_argument('--hash-size', type=int, default=22, help='hash_size from the config')
+    parser.add_argument('--algorithm', choices=get_all_hash_algorithms(), default=DEFAULT_HASH_ALGORITHM)
+    parser.add_argument('--threshold', type=int, default=0,
+                        help='largest drift in bits that counts as a match; exits non-zero if any picture drifts more')
+    args = parser.parse_args()
+    image_paths = _image_paths(args.paths)
+    if len(image_paths) == 0:
+        sys.exit('No pictures found')
+    sys.exit(0 if _compare(image_paths, args.hash_size, args.algorithm, args.threshold) else 1)
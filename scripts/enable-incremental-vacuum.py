@@ -0,0 +1,20 @@
+import sqlite3
+import sys
+
+
+def _enable_incremental_vacuum(db_path: str = 'repostdb.sqlite'):
+    with sqlite3.connect(db_path, isolation_level=None) as connection:
+        cursor = connection.cursor()
+        if cursor.execute('pragma auto_vacuum').fetchone()[0] == 2:
+            print('incremental vacuum is already on')
+            return
+        # the setting only takes effect once the whole file is rebuilt, which needs as much free disk space as the
+        # database takes up and can take a while on a big one. stop the bot first
+        print('turning on incremental vacuum and rebuilding the database...', end='')
+        cursor.execute('pragma auto_vacuum = INCREMENTAL')
+        cursor.execute('vacuum')
+        print('done!')
+
+
+if __name__ == "__main__":
+    _enable_incremental_vacuum(*sys.argv[1:2])
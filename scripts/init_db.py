@@ -1,74 +1,174 @@
+import os
 import sqlite3
+import sys
 import textwrap
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
 
-def init_db_tables():
-    with sqlite3.connect('repostdb.sqlite') as connection:
+from repostbot.db.connection import DatabaseSettings, configure_database, close_database  # noqa: E402
+from repostbot.db.migrations import MIGRATIONS  # noqa: E402
+from repostbot.db.schema_version_dao import SchemaVersionDAO  # noqa: E402
+
+
+def init_db_tables(db_path: str = 'repostdb.sqlite'):
+    with sqlite3.connect(db_path) as connection:
         cursor = connection.cursor()
+        if cursor.execute("select exists(select 1 from sqlite_master where type = 'table')").fetchone()[0]:
+            print(f'{db_path} already has tables. run scripts/migrate.py to bring it up to date instead')
+            return
+        # has to be set before any table is created; lets the bot hand free pages back a few at a time
+        cursor.execute('pragma auto_vacuum = INCREMENTAL')
+        cursor.execute('pragma journal_mode = WAL').fetchone()
         table_sql = [
             _init_reposts_db_sql(),
             _init_hash_whitelist_db_sql(),
-            _init_deleted_messages_table_sql()
+            _init_deleted_messages_table_sql(),
+            _init_file_hashes_table_sql(),
+            _init_forward_origins_table_sql(),
+            _init_group_settings_table_sql(),
+            _init_group_stats_table_sql(),
+            _init_user_reposts_table_sql()
         ]
         cursor.executescript("\n\n".join(table_sql))
 
+    # the tables above are already what every migration adds up to
+    configure_database(DatabaseSettings(path=db_path))
+    SchemaVersionDAO.create_tables()
+    SchemaVersionDAO.record_schema_version(MIGRATIONS[-1].version, MIGRATIONS[-1].description)
+    close_database()
+    print(f'created {db_path} at schema version {MIGRATIONS[-1].version}')
+
 
 def _init_reposts_db_sql():
     return textwrap.dedent("""
-        drop table if exists reposts;
-        
-        create table reposts(
+        create table if not exists reposts(
             id                INTEGER not null primary key autoincrement,
             group_id          INTEGER not null,
             user_id           INTEGER,
             message_id        INTEGER not null,
-            hash_value        TEXT not null,
-            hash_checked_date DATE
+            hash_value        BLOB not null,
+            hash_checked_date DATE,
+            hash_algorithm    TEXT,
+            kind              TEXT
         );
         
-        create index reposts_group_id_index
-            on reposts (group_id);
+        create index if not exists reposts_group_id_id_index
+            on reposts (group_id, id);
+        
+        create index if not exists reposts_group_id_kind_hash_value_index
+            on reposts (group_id, kind, hash_value, message_id);
             
-        create unique index reposts_group_id_message_id_hash_value_unique_index
+        create unique index if not exists reposts_group_id_message_id_hash_value_unique
             on reposts (group_id, message_id, hash_value);
     """)
 
 
 def _init_hash_whitelist_db_sql():
     return textwrap.dedent("""
-        drop table if exists hash_whitelist;
-        
-        create table hash_whitelist(
+        create table if not exists hash_whitelist(
             id         INTEGER not null primary key autoincrement,
             group_id   INTEGER not null,
-            hash_value TEXT not null
+            hash_value BLOB not null
         );
         
-        create index hash_whitelist_group_id_index
+        create index if not exists hash_whitelist_group_id_index
             on hash_whitelist (group_id);
             
-        create unique index hash_whitelist_group_id_hash_value_unique_index
+        create unique index if not exists hash_whitelist_group_id_hash_value_unique_index
             on hash_whitelist (group_id, hash_value);
     """)
 
 
 def _init_deleted_messages_table_sql():
     return textwrap.dedent("""
-        drop table if exists deleted_messages;
-        
-        create table deleted_messages(
+        create table if not exists deleted_messages(
             id         INTEGER not null primary key autoincrement,
             group_id   INTEGER not null,
             message_id INTEGER not null
         );
         
-        create index deleted_messages_group_id_index
+        create index if not exists deleted_messages_group_id_index
             on deleted_messages (group_id);
             
-        create unique index deleted_messages_group_id_message_id_unique_index
+        create unique index if not exists deleted_messages_group_id_message_id_unique_index
             on deleted_messages (group_id, message_id);
     """)
 
 
+def _init_file_hashes_table_sql():
+    return textwrap.dedent("""
+        create table if not exists file_hashes(
+            file_unique_id TEXT not null,
+            hash_size      INTEGER not null,
+            hash_algorithm TEXT not null,
+            hash_value     BLOB not null,
+            last_used_date DATE,
+            primary key (file_unique_id, hash_size, hash_algorithm)
+        ) without rowid;
+        
+        create index if not exists file_hashes_last_used_date_index
+            on file_hashes (last_used_date);
+    """)
+
+
+def _init_forward_origins_table_sql():
+    return textwrap.dedent("""
+        create table if not exists forward_origins(
+            group_id          INTEGER not null,
+            origin_chat_id    INTEGER not null,
+            origin_message_id INTEGER not null,
+            hash_algorithm    TEXT not null,
+            hash_value        BLOB not null,
+            primary key (group_id, origin_chat_id, origin_message_id, hash_algorithm)
+        ) without rowid;
+        
+        create index if not exists forward_origins_group_id_hash_value_index
+            on forward_origins (group_id, hash_value);
+    """)
+
+
+def _init_group_settings_table_sql():
+    return textwrap.dedent("""
+        create table if not exists group_settings(
+            group_id              INTEGER not null primary key,
+            track_pictures        INTEGER,
+            track_urls            INTEGER,
+            auto_callout          INTEGER,
+            auto_delete           INTEGER,
+            image_match_threshold INTEGER,
+            hash_algorithm        TEXT,
+            retention_days        INTEGER,
+            retention_max_rows    INTEGER
+        );
+    """)
+
+
+def _init_group_stats_table_sql():
+    return textwrap.dedent("""
+        create table if not exists group_stats(
+            group_id        INTEGER not null primary key,
+            unique_pictures INTEGER not null default 0,
+            picture_reposts INTEGER not null default 0,
+            unique_urls     INTEGER not null default 0,
+            url_reposts     INTEGER not null default 0
+        );
+    """)
+
+
+def _init_user_reposts_table_sql():
+    return textwrap.dedent("""
+        create table if not exists user_reposts(
+            group_id INTEGER not null,
+            user_id  INTEGER not null,
+            day      TEXT not null,
+            reposts  INTEGER not null default 0,
+            primary key (group_id, user_id, day)
+        ) without rowid;
+        
+        create index if not exists user_reposts_group_id_day_index
+            on user_reposts (group_id, day, user_id, reposts);
+    """)
+
+
 if __name__ == '__main__':
-    init_db_tables()
+    init_db_tables(*sys.argv[1:2])
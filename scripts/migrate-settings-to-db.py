@@ -0,0 +1,115 @@
+import itertools
+import os
+import sqlite3
+import sys
+import textwrap
+from typing import Any, Tuple
+
+import yaml
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+type Settings = Tuple[int, bool | None, bool | None, bool | None, bool | None, int | None, str | None]
+
+
+def _migrate_group_settings_to_db():
+    config_data = None
+    passed_argument = sys.argv[1] if len(sys.argv) > 1 else None
+    config_paths = itertools.product(
+        [file for file in [passed_argument, 'config.yaml', 'defaultconfig.yaml'] if file is not None],
+        ['config', '../config', os.path.curdir, os.path.pardir]
+    )
+    for config_file_name, config_path in config_paths:
+        try:
+            path = os.path.abspath(config_path)
+            joined = os.path.join(path, config_file_name)
+            with open(joined) as f:
+                config_data = yaml.safe_load(f)
+        except FileNotFoundError:
+            pass
+        else:
+            print(f"Using config file located at {joined}")
+            break
+    if config_data is None or config_data.get('repost_data_path') is None:
+        raise RuntimeError("Couldn't find group data folder name from config files")
+    else:
+        print("\n\nFinding group data")
+    group_data_folder_name = config_data['repost_data_path']
+    db_path = config_data.get('database', {}).get('path', 'repostdb.sqlite')
+    try:
+        path = os.path.abspath(group_data_folder_name)
+        files = os.listdir(path)
+    except FileNotFoundError:
+        path = os.path.abspath(f'../{group_data_folder_name}')
+        files = os.listdir(path)
+    files = [file for file in files if file[-5:] == '.json']
+    if len(files) == 0:
+        raise RuntimeError("Directory doesn't have any .json files")
+    print(f"Using group data in {path}")
+    error_files = 0
+    to_migrate_settings: list[Settings] = []
+    for file in files:
+        file_path = os.path.join(path, file)
+        try:
+            with open(file_path) as f:
+                group_data: dict[str, Any] = json.load(f)
+            group_id = int(file[:-5])
+            toggles: dict[str, bool] = group_data.get('toggles') or {}
+            to_migrate_settings.append((
+                group_id,
+                toggles.get('picture'),
+                toggles.get('url'),
+                toggles.get('autocallout'),
+                toggles.get('autodelete'),
+                group_data.get('image_match_threshold'),
+                group_data.get('hash_algorithm'),
+            ))
+        except Exception as e:
+            error_files += 1
+            print(f'whoopsie on {file}: {e}')
+        else:
+            print(f"{file} read")
+
+    if len(to_migrate_settings) == 0:
+        print('nothing to migrate')
+        return
+
+    print(f'all files read, {error_files} with errors. migrating to database at {db_path}.')
+    with sqlite3.connect(db_path) as connection:
+        cursor = connection.cursor()
+        cursor.executescript(textwrap.dedent("""
+            create table if not exists group_settings(
+                group_id              INTEGER not null primary key,
+                track_pictures        INTEGER,
+                track_urls            INTEGER,
+                auto_callout          INTEGER,
+                auto_delete           INTEGER,
+                image_match_threshold INTEGER,
+                hash_algorithm        TEXT,
+                retention_days        INTEGER,
+                retention_max_rows    INTEGER
+            );
+        """))
+        print('inserting group settings...', end='')
+        # groups already in the table were changed through the bot since, so they're left alone
+        inserted = connection.total_changes
+        cursor.executemany(
+            '''
+             insert or ignore into group_settings(group_id, track_pictures, track_urls, auto_callout, auto_delete,
+                                                  image_match_threshold, hash_algorithm)
+             values (?, ?, ?, ?, ?, ?, ?)
+             ''',
+            to_migrate_settings
+        )
+        inserted = connection.total_changes - inserted
+        print('done!')
+
+    print(f'finished migrating {inserted} of {len(to_migrate_settings)} groups to the database.')
+    print(f'the bot no longer reads {path}; you can delete it once you have checked your groups\' settings.')
+
+
+if __name__ == "__main__":
+    _migrate_group_settings_to_db()
@@ -7,6 +7,12 @@ from typing import Any, Tuple
 
 import yaml
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+from repostbot.db.connection import DatabaseSettings, configure_database, close_database  # noqa: E402
+from repostbot.db.hash_encoding import encode_hash, decode_hash  # noqa: E402
+from repostbot.db.migrations import recount_reposts, repost_kinds_ambiguous  # noqa: E402
+
 try:
     import ujson as json
 except ImportError:
@@ -21,6 +27,7 @@ type Whitelisted = Tuple[int, str]
 
 def _migrate_group_data_to_db():
     group_data_folder_name = None
+    hash_size = None
     passed_argument = sys.argv[1] if len(sys.argv) > 1 else None
     config_paths = itertools.product(
         [file for file in [passed_argument, 'config.yaml', 'defaultconfig.yaml'] if file is not None],
@@ -31,7 +38,9 @@ def _migrate_group_data_to_db():
             path = os.path.abspath(config_path)
             joined = os.path.join(path, config_file_name)
             with open(joined) as f:
-                group_data_folder_name = yaml.safe_load(f)['repost_data_path']
+                config_data = yaml.safe_load(f)
+                group_data_folder_name = config_data['repost_data_path']
+                hash_size = config_data.get('hash_size')
         except FileNotFoundError:
             pass
         else:
@@ -39,6 +48,9 @@ def _migrate_group_data_to_db():
             break
     if group_data_folder_name is None:
         raise RuntimeError("Couldn't find group data folder name from config files")
+    if hash_size is not None and repost_kinds_ambiguous(hash_size):
+        raise RuntimeError(f"With hash_size {hash_size}, picture hashes are 64 characters long, the same as URL "
+                           f"hashes, so the group data can't be sorted into pictures and URLs")
     else:
         print("\n\nFinding group data")
     try:
@@ -105,16 +117,24 @@ def _migrate_group_data_to_db():
         cursor = connection.cursor()
         now = datetime.now()
         print('inserting reposts...', end='')
+        # url hashes are sha256 hex digests, and pictures were all hashed at a shorter length
         cursor.executemany(
-            'insert into reposts(group_id, user_id, message_id, hash_value, hash_checked_date) values (?, null, ?, ?, ?)',
-            ((*repost_params, now) for repost_params in to_migrate_reposts)
+            '''
+             insert into reposts(group_id, user_id, message_id, hash_value, hash_checked_date, kind)
+             values (?, null, ?, ?, ?, ?)
+             ''',
+            (
+                (group_id, message_id, encode_hash(decode_hash(hash_value)), now,
+                 'url' if len(hash_value) == 64 else 'picture')
+                for group_id, message_id, hash_value in to_migrate_reposts
+            )
         )
         print('done!')
 
         print('inserting whitelist...', end='')
         cursor.executemany(
             'insert into hash_whitelist(group_id, hash_value) values (?, ?)',
-            to_migrate_whitelisted
+            ((group_id, encode_hash(decode_hash(hash_value))) for group_id, hash_value in to_migrate_whitelisted)
         )
         print('done!')
 
@@ -125,6 +145,12 @@ def _migrate_group_data_to_db():
         )
         print('done!')
 
+    print('counting reposts...', end='')
+    configure_database(DatabaseSettings())
+    recount_reposts()
+    close_database()
+    print('done!')
+
     print('finished migrating to the database.')
     print('culling group data files...')
     _cull_files(path, files)
@@ -0,0 +1,55 @@
+import argparse
+import logging
+import os
+import sys
+
+import yaml
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+from repostbot.db.connection import DatabaseSettings, configure_database, close_database  # noqa: E402
+from repostbot.db.migrations import apply_migrations, LATEST_SCHEMA_VERSION, REQUIRED_SCHEMA_VERSION  # noqa: E402
+from repostbot.db.schema_version_dao import SchemaVersionDAO  # noqa: E402
+
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+_CONFIG_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir, 'config'))
+
+
+def _configured_hash_size(config_path: str) -> int:
+    # the migrations need to know how long the pictures' hashes are to tell them apart from urls
+    for path in (config_path, os.path.join(_CONFIG_DIRECTORY, 'defaultconfig.yaml')):
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            hash_size = (yaml.safe_load(f) or {}).get('hash_size')
+        if hash_size is not None:
+            print(f'Using hash_size {hash_size} from {path}')
+            return int(hash_size)
+    sys.exit("Couldn't find hash_size in the config files")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bring the database up to the latest schema version')
+    parser.add_argument('db_path', nargs='?', default='repostdb.sqlite')
+    parser.add_argument('--to', type=int, default=LATEST_SCHEMA_VERSION, dest='target_version',
+                        help=f'stop at this version. the bot needs at least {REQUIRED_SCHEMA_VERSION}')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows changed per transaction')
+    parser.add_argument('--pause-ms', type=int, default=50, help='pause between batches to let the bot write')
+    parser.add_argument('--status', action='store_true', help='only print the schema version')
+    parser.add_argument('-c', '--config', default=os.path.join(_CONFIG_DIRECTORY, 'config.yaml'),
+                        help="the bot's config file, for its hash_size")
+    args = parser.parse_args()
+    if not os.path.exists(args.db_path):
+        sys.exit(f'{args.db_path} does not exist. create it with scripts/init_db.py')
+    configure_database(DatabaseSettings(path=args.db_path))
+    try:
+        if args.status:
+            print(f'schema version {SchemaVersionDAO.get_schema_version()} of {LATEST_SCHEMA_VERSION}')
+        else:
+            # stopping it part of the way through is fine; running it again carries on from the last batch
+            version = apply_migrations(args.batch_size, args.pause_ms, _configured_hash_size(args.config),
+                                       args.target_version)
+            print(f'database is at schema version {version} of {LATEST_SCHEMA_VERSION}')
+    finally:
+        close_database()
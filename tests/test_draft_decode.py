@@ -0,0 +1,57 @@
+import io
+import unittest
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from repostbot.hash_algorithms import get_all_hash_algorithms, get_hash_algorithm
+from repostbot.image_hashing import hash_images
+
+_HASH_SIZES = [8, 22]
+# bits a hash may move by when the jpeg is decoded at a reduced scale
+_MAX_DRIFT_BITS = 8
+
+
+def _make_jpeg(seed: int) -> bytes:
+    # smooth gradients and soft shapes, so the pictures look more like photos than noise does
+    rng = np.random.default_rng(seed)
+    width, height = 1280, 960
+    y, x = np.mgrid[0:height, 0:width]
+    channels = [(x * rng.uniform(0.05, 0.2) + y * rng.uniform(0.05, 0.2)) % 256 for _ in range(3)]
+    image = Image.fromarray(np.stack(channels, axis=-1).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        left, top = rng.integers(0, width), rng.integers(0, height)
+        draw.ellipse([left, top, left + rng.integers(50, 400), top + rng.integers(50, 400)],
+                     fill=tuple(int(value) for value in rng.integers(0, 256, 3)))
+    image = image.filter(ImageFilter.GaussianBlur(3))
+    data = io.BytesIO()
+    image.save(data, 'JPEG', quality=90)
+    return data.getvalue()
+
+
+class DraftDecodeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.jpegs = [_make_jpeg(seed) for seed in range(6)]
+
+    def test_draft_decodes_at_a_reduced_scale(self):
+        for algorithm in get_all_hash_algorithms():
+            with Image.open(io.BytesIO(self.jpegs[0])) as image:
+                image.draft('L', get_hash_algorithm(algorithm).resize_dimensions(max(_HASH_SIZES)))
+                self.assertLess(image.size[0], 1280, algorithm)
+
+    def test_draft_hashes_stay_close_to_full_decode_hashes(self):
+        for algorithm in get_all_hash_algorithms():
+            for hash_size in _HASH_SIZES:
+                with self.subTest(algorithm=algorithm, hash_size=hash_size):
+                    full_hashes = hash_images(self.jpegs, hash_size, algorithm, draft_decode=False)
+                    draft_hashes = hash_images(self.jpegs, hash_size, algorithm, draft_decode=True)
+                    drifts = [(int(full, 16) ^ int(draft, 16)).bit_count()
+                              for full, draft in zip(full_hashes, draft_hashes)]
+                    self.assertLessEqual(max(drifts), _MAX_DRIFT_BITS, drifts)
+
+
+if __name__ == "__main__":
+    unittest.main()
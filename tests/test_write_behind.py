@@ -0,0 +1,75 @@
+import unittest
+from unittest import mock
+
+from repostbot.db.write_behind import PendingRepost, PendingWrite, WriteBehindBuffer
+
+
+class WriteBehindBufferTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.committed: list[int] = []
+        self.poisoned_message_id = 2
+        patcher = mock.patch("repostbot.db.write_behind.RepostDAO.insert_reposts_for_group",
+                             side_effect=self._insert_reposts_for_group)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = WriteBehindBuffer(flush_interval_ms=60_000, max_rows=1_000, write_batch=self._write_batch,
+                                        max_retries=2)
+
+    def _insert_reposts_for_group(self, group_id, user_id, message_id, *args):
+        if message_id == self.poisoned_message_id:
+            raise RuntimeError("constraint failed")
+        self._transaction.append(message_id)
+
+    async def _write_batch(self, writes: list[PendingWrite]) -> None:
+        # all or nothing, like the transaction the storage commits a batch in
+        self._transaction = []
+        for write in writes:
+            write.apply()
+        self.committed.extend(self._transaction)
+
+    def _add(self, message_id: int) -> None:
+        self.buffer.add(PendingRepost(1, 10, message_id, frozenset({f"hash{message_id}"})))
+
+    async def test_failed_batch_is_retried_then_committed_one_at_a_time(self):
+        for message_id in (1, 2, 3):
+            self._add(message_id)
+        with self.assertLogs("WriteBehindBuffer", "ERROR") as logs:
+            await self.buffer.flush()
+            await self.buffer.flush()
+            self.assertEqual(self.committed, [])
+            self.assertEqual(len(self.buffer.pending_for_group(1)), 3)
+            await self.buffer.flush()
+        self.assertEqual(self.committed, [1, 3])
+        self.assertEqual(self.buffer.pending_for_group(1), [])
+        self.assertIn("Dropping buffered write", logs.output[-1])
+        self.assertIn("message_id=2", logs.output[-1])
+
+    async def test_later_writes_still_land(self):
+        self._add(2)
+        for _ in range(3):
+            with self.assertLogs("WriteBehindBuffer", "ERROR"):
+                await self.buffer.flush()
+        self._add(4)
+        self._add(5)
+        await self.buffer.flush()
+        self.assertEqual(self.committed, [4, 5])
+        self.assertEqual(self.buffer.pending_for_group(1), [])
+
+    async def test_successful_flush_resets_the_retry_count(self):
+        self._add(2)
+        with self.assertLogs("WriteBehindBuffer", "ERROR"):
+            await self.buffer.flush()
+            await self.buffer.flush()
+        self.poisoned_message_id = None
+        await self.buffer.flush()
+        self.assertEqual(self.committed, [2])
+        self.poisoned_message_id = 6
+        self._add(6)
+        with self.assertLogs("WriteBehindBuffer", "ERROR"):
+            await self.buffer.flush()
+        self.assertEqual(len(self.buffer.pending_for_group(1)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
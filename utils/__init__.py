@@ -1,21 +1,18 @@
-import asyncio
 import itertools
 import logging
 import string
 from dataclasses import dataclass
-from datetime import datetime
 from functools import wraps
-from typing import ValuesView
 
 import telegram.constants
 from telegram import Update, Message
 from telegram.ext import CallbackContext
 
-logger = logging.getLogger("Flood Protection")
+from .rate_limiter import RateLimiter
 
-_flood_track: dict[int, dict[str, datetime]] = dict()
+logger = logging.getLogger("Flood Protection")
 
-_lock = asyncio.Lock()
+_rate_limiter = RateLimiter()
 
 
 @dataclass(frozen=True)
@@ -37,49 +34,19 @@ def flood_protection(command_key: str):
             logger.info(f"Command called: {command_key}")
             effective_user = update.effective_user if update.effective_user is not None else update.effective_chat
             effective_user_id = effective_user.id
-            async with _lock:
-                _init_tracking_for_user(effective_user_id)
-                threshold = repostbot_instance.flood_protection_timeout
-                last_called = _flood_track.get(effective_user_id).get(command_key)
-                if last_called is None or (datetime.now() - last_called).total_seconds() > threshold:
-                    _clean_up_tracking(threshold)
-                    _flood_track.get(effective_user_id).update({command_key: datetime.now()})
-                    return await func(repostbot_instance, update, context, *args, **kwargs)
-                else:
-                    logger.info(f"Anti-flood protection on key {command_key}")
+            threshold = repostbot_instance.flood_protection_timeout
+            # checking and recording the call don't await anything, so there's nothing to lock and commands from
+            # other users and groups are never held up by this one
+            if _rate_limiter.try_acquire((effective_user_id, command_key), threshold):
+                return await func(repostbot_instance, update, context, *args, **kwargs)
+            else:
+                logger.info(f"Anti-flood protection on key {command_key}")
 
         return _wrapped
 
     return _inner
 
 
-def _init_tracking_for_user(user_id: int) -> None:
-    if _flood_track.get(user_id) is None:
-        _flood_track.update({user_id: dict()})
-
-
-def _clean_up_tracking(threshold: int):
-    now = datetime.now()
-    num_users = len(_flood_track.keys())
-    updated_flood_track = {
-        user_id: {
-            command_key: last_command_called
-            for command_key, last_command_called in _flood_track.get(user_id).items()
-            if (now - last_command_called).total_seconds() > threshold
-        }
-        for user_id in _flood_track.keys()
-    }
-    _flood_track.clear()
-    _flood_track.update(updated_flood_track)
-    users_remaining = len(updated_flood_track.keys())
-    users_removed = num_users - users_remaining
-    logger.info(f"Cleaned tracking. Users remaining: {users_remaining}. Users removed: {users_removed}")
-
-
-def sum_list_lengths(lists: ValuesView) -> int:
-    return sum(len(_list) for _list in lists)
-
-
 def message_from_anonymous_admin(user_id: int) -> bool:
     return user_id == telegram.constants.ChatID.ANONYMOUS_ADMIN
 
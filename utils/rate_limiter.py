@@ -0,0 +1,35 @@
+import heapq
+import time
+from typing import Callable
+
+type RateLimitKey = tuple[int, str]
+
+
+class RateLimiter:
+    # a sliding window that holds one call per key: a key is allowed again once the cooldown since its last allowed
+    # call has passed. calls that are turned away don't extend it.
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._expiries: dict[RateLimitKey, float] = dict()
+        self._expiry_heap: list[tuple[float, RateLimitKey]] = []
+
+    def __len__(self) -> int:
+        return len(self._expiries)
+
+    def try_acquire(self, key: RateLimitKey, cooldown: float) -> bool:
+        now = self._clock()
+        self._expire(now)
+        expiry = self._expiries.get(key)
+        if expiry is not None and now <= expiry:
+            return False
+        expiry = now + cooldown
+        self._expiries[key] = expiry
+        heapq.heappush(self._expiry_heap, (expiry, key))
+        return True
+
+    def _expire(self, now: float) -> None:
+        # only keys whose cooldown is over are touched, so this costs nothing for the users that are still active
+        while len(self._expiry_heap) > 0 and self._expiry_heap[0][0] < now:
+            expiry, key = heapq.heappop(self._expiry_heap)
+            if self._expiries.get(key) == expiry:
+                del self._expiries[key]